@@ -10,18 +10,45 @@ import traceback
 import logging
 import subprocess
 import re
+import random
+import shutil
 from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, ValidationError
 from typing import Optional
-from python.music_analyzer import analyze_audio_simple
+from python.music_analyzer import analyze_audio_simple, iter_analysis_simple
+from python.mix_analysis import analyze_mix
+from python.chunked_upload import (
+    OffsetMismatch,
+    UploadNotFound,
+    append_chunk,
+    complete_upload,
+    create_upload,
+    upload_status,
+)
+from python.encoding import encode_result, encode_event, negotiate_stream_type, MEDIA_TYPE_NDJSON, WAVEFORM_DTYPES
 import json
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Optioneel: fingerprint index om analyses te hergebruiken voor andere encodings van dezelfde opname
+FINGERPRINT_INDEX_PATH = os.environ.get("FINGERPRINT_INDEX_PATH") or None
+
+# Worker recycling (alleen actief in pre-fork workers, zie gunicorn.conf.py)
+# librosa/numba geheugen groeit over tijd; een verse worker geeft dat terug aan het OS
+MAX_ANALYSES_PER_WORKER = int(os.environ.get("MAX_ANALYSES_PER_WORKER", "0"))
+# Willekeurige extra analyses per worker, zodat workers niet tegelijk recyclen
+MAX_ANALYSES_JITTER = int(os.environ.get("MAX_ANALYSES_JITTER", "0"))
+MAX_WORKER_RSS_MB = float(os.environ.get("MAX_WORKER_RSS_MB", "0"))
+analyses_done = 0
+analysis_limit = None
+# Gelezen door de gunicorn worker (gunicorn.conf.py), die dan stopt met accepteren en afbouwt
+recycle_requested = False
+
 app = FastAPI()
 
 # CORS middleware voor cross-origin requests van Vercel frontend
@@ -33,6 +60,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def close_connection_when_recycling(request: Request, call_next):
+    """Zodra de worker gaat recyclen: geen keep-alive meer, clients openen een nieuwe verbinding"""
+    response = await call_next(request)
+    if recycle_requested:
+        response.headers["Connection"] = "close"
+    return response
+
+
 # Startup event voor logging
 @app.on_event("startup")
 async def startup_event():
@@ -59,6 +95,18 @@ class AnalyzeRequest(BaseModel):
         extra = "allow"
 
 
+class CreateUploadRequest(BaseModel):
+    """Request model voor een nieuwe chunked upload"""
+    filename: str
+    size: Optional[int] = None  # Totale grootte in bytes (aanbevolen)
+
+
+class CompleteUploadRequest(BaseModel):
+    """Request model voor het afronden van een chunked upload"""
+    include_waveform: bool = False
+    waveform_dtype: Optional[str] = None
+
+
 class DownloadRequest(BaseModel):
     """Request model voor muziek download"""
     source: str  # 'youtube', 'soundcloud', 'search'
@@ -78,9 +126,13 @@ async def health():
 
 @app.post("/api/analyze")
 async def analyze(
+    request: Request,
     file: Optional[UploadFile] = File(None),
     file_path: Optional[str] = Form(None),
-    include_waveform: Optional[str] = Form(None)
+    include_waveform: Optional[str] = Form(None),
+    waveform_dtype: Optional[str] = Form(None),
+    stream: Optional[str] = Form(None),
+    mode: Optional[str] = Form(None)
 ):
     """
     Analyseer audio bestand
@@ -89,9 +141,20 @@ async def analyze(
     - file: UploadFile (multipart/form-data)
     - file_path: pad naar audio bestand (als al op server) - via form field
     - include_waveform: boolean via form field (string: "true" of "false", optioneel)
+    - waveform_dtype: "int8", "int16" of "float32" (optioneel, kwantisatie van de waveform)
+    - stream: "true" voor een gestreamd NDJSON resultaat (optioneel)
+    - mode: "track" (default) of "mix" - mix analyseert de volledige opname en geeft
+      segmenten (tracklist) met BPM, key en energie per segment
+    
+    Response formaat via content negotiation (zie python/encoding.py):
+    - Accept: application/json (default), application/x-msgpack of application/vnd.opperbeat.analysis
+    - Accept: application/x-ndjson of text/event-stream voor een gestreamd resultaat:
+      één event per veldgroep zodra die klaar is (metadata, waveform, tempo, key), daarna 'done'
+    - Accept-Encoding: br of gzip (niet voor gestreamde resultaten)
     """
     should_cleanup = False
     temp_file_path = None
+    analysis_started = False
     
     try:
         logger.info("Received analyze request")
@@ -101,6 +164,19 @@ async def analyze(
         logger.info(f"File path provided: {file_path is not None}")
         logger.info(f"Include waveform: {include_waveform} (type: {type(include_waveform)})")
         
+        # Valideer waveform dtype voordat we gaan analyseren
+        if waveform_dtype is not None and waveform_dtype not in WAVEFORM_DTYPES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Ongeldig waveform_dtype: {waveform_dtype}. Gebruik {', '.join(WAVEFORM_DTYPES)}"
+            )
+        
+        if mode not in (None, "", "track", "mix"):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Ongeldige mode: {mode}. Gebruik 'track' of 'mix'"
+            )
+        
         # Check of file of file_path is gegeven
         if not file and not file_path:
             logger.error("No file or file_path provided")
@@ -117,17 +193,19 @@ async def analyze(
             safe_filename = "".join(c for c in safe_filename if c.isalnum() or c in "._- ")
             logger.info(f"Processing uploaded file: {safe_filename}, content_type: {file.content_type}")
             
-            # Maak temp file met veilige naam
-            temp_dir = tempfile.gettempdir()
-            file_ext = os.path.splitext(safe_filename)[1] or ".tmp"
-            temp_file_path = os.path.join(temp_dir, f"audio_{os.urandom(8).hex()}{file_ext}")
+            # Maak temp file met de originele (veilige) naam in een eigen temp map, zodat
+            # song_name en de fingerprint index de echte bestandsnaam zien i.p.v. een random naam
+            safe_filename = safe_filename.strip(". ") or "audio_file"
+            if not os.path.splitext(safe_filename)[1]:
+                safe_filename += ".tmp"
+            temp_file_path = os.path.join(tempfile.mkdtemp(prefix="audio_"), safe_filename)
             logger.info(f"Writing temp file: {temp_file_path}")
             
-            # Schrijf uploaded file naar temp file
+            # Kopieer de upload in stukken naar het temp file (niet eerst helemaal in het geheugen;
+            # een mix kan honderden MB zijn)
             with open(temp_file_path, 'wb') as f:
-                content = await file.read()
-                f.write(content)
-                logger.info(f"File written, size: {len(content)} bytes")
+                await run_in_threadpool(shutil.copyfileobj, file.file, f, 1024 * 1024)
+                logger.info(f"File written, size: {f.tell()} bytes")
             
             file_path = temp_file_path
             should_cleanup = True
@@ -155,6 +233,19 @@ async def analyze(
             file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
             logger.info(f"File size: {file_size_mb:.2f} MB")
             
+            # Mix modus: volledige opname streamen en segmenteren (geen max_duration, geheugen blijft constant)
+            if mode == "mix":
+                analysis_started = True
+                logger.info(f"Starting mix analysis for: {file_path}")
+                result = await run_in_threadpool(analyze_mix, file_path)
+                logger.info(f"Mix analysis complete, {result['segment_count']} segments")
+                body, media_type, headers = encode_result(
+                    result,
+                    accept=request.headers.get("accept"),
+                    accept_encoding=request.headers.get("accept-encoding")
+                )
+                return Response(content=body, media_type=media_type, headers=headers)
+            
             # Converteer include_waveform string naar boolean (veilige conversie)
             if include_waveform is None or include_waveform == "":
                 include_waveform_bool = False  # Default False voor performance
@@ -187,16 +278,55 @@ async def analyze(
                 max_duration = None  # Analyseer volledig bestand
                 logger.info(f"Small file, using full analysis: sample_rate={sample_rate}, waveform={include_waveform_bool}")
             
+            # Gestreamd resultaat: elke veldgroep als apart event zodra die berekend is
+            stream_type = negotiate_stream_type(request.headers.get("accept"))
+            if stream_type is None and stream and stream.lower().strip() in ('true', '1', 'yes', 'on'):
+                stream_type = MEDIA_TYPE_NDJSON
+            if stream_type:
+                logger.info(f"Starting streamed audio analysis ({stream_type}) for: {file_path}")
+                events = stream_analysis(
+                    file_path,
+                    stream_type,
+                    cleanup_path=temp_file_path if should_cleanup else None,
+                    waveform_dtype=waveform_dtype,
+                    sample_rate=sample_rate,
+                    include_waveform=include_waveform_bool,
+                    waveform_samples=waveform_samples,
+                    max_duration=max_duration,
+                    waveform_as_array=True,
+                    fingerprint_index=FINGERPRINT_INDEX_PATH
+                )
+                # De generator ruimt het temp bestand op als de stream klaar is
+                should_cleanup = False
+                return StreamingResponse(
+                    events,
+                    media_type=stream_type,
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+                )
+            
+            analysis_started = True
             logger.info(f"Starting audio analysis for: {file_path}, sample_rate: {sample_rate}, include_waveform: {include_waveform_bool}, waveform_samples: {waveform_samples}, max_duration: {max_duration}")
-            result = analyze_audio_simple(
+            # In de threadpool, zodat de event loop (en de gunicorn heartbeat) door blijft lopen
+            result = await run_in_threadpool(
+                analyze_audio_simple,
                 file_path,
                 sample_rate=sample_rate,
                 include_waveform=include_waveform_bool,
                 waveform_samples=waveform_samples,
-                max_duration=max_duration
+                max_duration=max_duration,
+                waveform_as_array=True,
+                fingerprint_index=FINGERPRINT_INDEX_PATH
             )
             logger.info(f"Audio analysis complete, BPM: {result.get('bpm')}, Key: {result.get('key')}")
-            return result
+            
+            body, media_type, headers = encode_result(
+                result,
+                accept=request.headers.get("accept"),
+                accept_encoding=request.headers.get("accept-encoding"),
+                waveform_dtype=waveform_dtype
+            )
+            logger.info(f"Encoded response: {media_type}, {len(body)} bytes, encoding: {headers.get('Content-Encoding', 'identity')}")
+            return Response(content=body, media_type=media_type, headers=headers)
             
         except Exception as e:
             logger.error(f"Audio analysis error: {str(e)}")
@@ -226,11 +356,212 @@ async def analyze(
         )
     finally:
         # Cleanup temp file als we die hebben gemaakt
-        if should_cleanup and temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.unlink(temp_file_path)
-            except:
-                pass
+        if should_cleanup and temp_file_path:
+            remove_temp_upload(temp_file_path)
+        # Gestreamde analyses worden geteld als de stream klaar is
+        if analysis_started:
+            after_analysis()
+
+
+def stream_analysis(file_path: str, media_type: str, cleanup_path: Optional[str] = None,
+                    waveform_dtype: Optional[str] = None, **options):
+    """
+    Genereer events van een gestreamde analyse (draait in de threadpool van StreamingResponse)
+    
+    Fouten tijdens de analyse worden als 'error' event verstuurd, omdat de HTTP status
+    al verzonden is zodra het eerste event de deur uit is.
+    """
+    try:
+        for group, fields in iter_analysis_simple(file_path, **options):
+            logger.info(f"Streaming analysis group: {group}")
+            yield encode_event(group, fields, media_type, waveform_dtype)
+        yield encode_event("done", {}, media_type)
+    except Exception as e:
+        logger.error(f"Audio analysis error (stream): {str(e)}")
+        logger.error(traceback.format_exc())
+        yield encode_event("error", {"detail": f"Fout bij audio analyse: {str(e)}"}, media_type)
+    finally:
+        if cleanup_path:
+            remove_temp_upload(cleanup_path)
+        after_analysis()
+
+
+def remove_temp_upload(path: str):
+    """Verwijder een geüpload temp bestand en de temp map eromheen"""
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+    try:
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        pass
+
+
+def current_rss_mb() -> float:
+    """Huidig geheugengebruik (resident set size) van dit proces in MB"""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # Geen /proc (bijv. macOS): piekgebruik is de beste benadering
+        import resource
+        import sys
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+
+
+def after_analysis():
+    """
+    Tel een afgeronde analyse en vraag een recycle aan als een limiet bereikt is
+    
+    De worker wordt niet direct gestopt (dat breekt keep-alive verbindingen en net
+    geaccepteerde requests af). Responses krijgen vanaf nu Connection: close, en de
+    gunicorn worker (gunicorn.conf.py) stopt met accepteren, maakt lopende requests af en
+    stopt pas daarna; gunicorn start een verse worker vanuit het (warme) parent proces.
+    Buiten gunicorn (bijv. lokaal met uvicorn) wordt nooit gerecycled.
+    """
+    global analyses_done, analysis_limit, recycle_requested
+    analyses_done += 1
+    
+    if recycle_requested or os.environ.get("OPPERBEAT_PREFORK_WORKER") != "1":
+        return
+    
+    if analysis_limit is None and MAX_ANALYSES_PER_WORKER:
+        # Per worker bepaald (na de fork), met de pid als seed
+        analysis_limit = MAX_ANALYSES_PER_WORKER + random.Random(os.getpid()).randint(0, MAX_ANALYSES_JITTER)
+    
+    reason = None
+    if analysis_limit and analyses_done >= analysis_limit:
+        reason = f"{analyses_done} analyses"
+    elif MAX_WORKER_RSS_MB:
+        rss_mb = current_rss_mb()
+        if rss_mb >= MAX_WORKER_RSS_MB:
+            reason = f"RSS {rss_mb:.0f} MB >= {MAX_WORKER_RSS_MB:.0f} MB"
+    
+    if reason:
+        recycle_requested = True
+        logger.info(f"Recycling worker {os.getpid()} na {reason}")
+
+
+def offset_response(status: dict, status_code: int = 200) -> JSONResponse:
+    """Status van een chunked upload, met de bevestigde offset ook als header"""
+    return JSONResponse(status, status_code=status_code, headers={"Upload-Offset": str(status["offset"])})
+
+
+def offset_mismatch_response(error: OffsetMismatch) -> JSONResponse:
+    """409: de client moet hervatten vanaf de offset die de server bevestigd heeft"""
+    return JSONResponse(
+        {"detail": str(error), "offset": error.offset},
+        status_code=409,
+        headers={"Upload-Offset": str(error.offset)}
+    )
+
+
+@app.post("/api/analyze/uploads")
+async def create_analysis_upload(body: CreateUploadRequest):
+    """
+    Start een hervatbare chunked upload
+    
+    Daarna: PUT /api/analyze/uploads/{upload_id}?offset=N met de ruwe bytes van elke chunk,
+    en POST /api/analyze/uploads/{upload_id}/complete voor het resultaat. De analyse begint
+    al bij de eerste chunk, zodat upload en analyse overlappen (zie python/chunked_upload.py).
+    """
+    if body.size is not None and body.size <= 0:
+        raise HTTPException(status_code=400, detail="size moet groter dan 0 zijn")
+    status = await run_in_threadpool(create_upload, body.filename, body.size)
+    logger.info(f"Created chunked upload {status['upload_id']} for {status['filename']} ({body.size} bytes)")
+    return offset_response(status, status_code=201)
+
+
+@app.get("/api/analyze/uploads/{upload_id}")
+async def get_analysis_upload(upload_id: str):
+    """Status van een chunked upload; offset is waar een onderbroken upload verder moet gaan"""
+    try:
+        return offset_response(await run_in_threadpool(upload_status, upload_id))
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload niet gevonden")
+
+
+@app.put("/api/analyze/uploads/{upload_id}")
+async def put_analysis_upload_chunk(upload_id: str, offset: int, request: Request):
+    """
+    Voeg een chunk toe (body = ruwe bytes) op de gegeven offset
+    
+    Geeft 409 met de bevestigde offset als die niet overeenkomt (bijv. na een onderbroken
+    request), zodat de client vanaf daar kan hervatten.
+    """
+    data = await request.body()
+    try:
+        status = await run_in_threadpool(append_chunk, upload_id, offset, data)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload niet gevonden")
+    except OffsetMismatch as e:
+        return offset_mismatch_response(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return offset_response(status)
+
+
+@app.post("/api/analyze/uploads/{upload_id}/complete")
+async def complete_analysis_upload(upload_id: str, request: Request, body: Optional[CompleteUploadRequest] = None):
+    """
+    Rond een chunked upload af en geef het analyse resultaat (zelfde velden en content
+    negotiation als /api/analyze)
+    
+    Veld analysis_method (en header X-Analysis-Pipeline): 'live' als de features al tijdens
+    de upload berekend zijn, 'full' als het volledige bestand alsnog geanalyseerd moest
+    worden. De twee gebruiken andere BPM/key schatters, zie python/chunked_upload.py.
+    """
+    body = body or CompleteUploadRequest()
+    if body.waveform_dtype is not None and body.waveform_dtype not in WAVEFORM_DTYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Ongeldig waveform_dtype: {body.waveform_dtype}. Gebruik {', '.join(WAVEFORM_DTYPES)}"
+        )
+    
+    analysis_started = False
+    try:
+        status = await run_in_threadpool(upload_status, upload_id)
+        
+        # Zonder live pipeline: dezelfde grootte-heuristiek als /api/analyze (Railway timeout)
+        file_size_mb = status["offset"] / (1024 * 1024)
+        fallback_options = {"sample_rate": 22050 if file_size_mb > 3 else 44100}
+        if file_size_mb > 5:
+            fallback_options["max_duration"] = 120
+        
+        analysis_started = True
+        result, pipelined = await run_in_threadpool(
+            complete_upload,
+            upload_id,
+            include_waveform=body.include_waveform,
+            waveform_as_array=True,
+            fingerprint_index=FINGERPRINT_INDEX_PATH,
+            **fallback_options
+        )
+        logger.info(f"Chunked upload {upload_id} analyzed ({'live' if pipelined else 'full'}), BPM: {result.get('bpm')}, Key: {result.get('key')}")
+        
+        response_body, media_type, headers = encode_result(
+            result,
+            accept=request.headers.get("accept"),
+            accept_encoding=request.headers.get("accept-encoding"),
+            waveform_dtype=body.waveform_dtype
+        )
+        headers["X-Analysis-Pipeline"] = "live" if pipelined else "full"
+        return Response(content=response_body, media_type=media_type, headers=headers)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload niet gevonden")
+    except OffsetMismatch as e:
+        analysis_started = False
+        return offset_mismatch_response(e)
+    except Exception as e:
+        logger.error(f"Audio analysis error (chunked upload): {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Fout bij audio analyse: {str(e)}")
+    finally:
+        if analysis_started:
+            after_analysis()
 
 
 def is_youtube_url(url: str) -> bool:
@@ -0,0 +1,118 @@
+"""
+Gunicorn configuratie voor productie: pre-fork workers met een preloaded analyzer
+
+Het parent proces importeert api.analyze (en daarmee librosa/numpy) en compileert de
+numba kernels één keer. Daarna worden de workers geforkt, die dat geheugen copy-on-write
+delen. Workers worden gerecycled na MAX_ANALYSES_PER_WORKER analyses of boven
+MAX_WORKER_RSS_MB geheugen (zie api/analyze.py). Een recyclende worker stopt eerst met
+accepteren en maakt lopende requests af, zodat clients geen verbroken requests zien.
+
+Start:
+    gunicorn -c gunicorn.conf.py api.analyze:app
+
+Environment variables:
+    PORT                     Poort (default: 8000)
+    WEB_CONCURRENCY          Aantal workers (default: aantal cores)
+    MAX_ANALYSES_PER_WORKER  Recycle worker na zoveel analyses (default: 200, 0 = nooit)
+    MAX_ANALYSES_JITTER      Willekeurig 0-N analyses extra per worker (default: 20)
+    MAX_WORKER_RSS_MB        Recycle worker boven dit geheugengebruik in MB (default: 0 = uit)
+    WORKER_TIMEOUT           Seconden zonder heartbeat voordat een worker gekilld wordt (default: 120)
+    GRACEFUL_TIMEOUT         Seconden om lopende requests af te maken bij stoppen (default: 60)
+"""
+
+import gc
+import os
+import socket
+import sys
+import time
+
+from gunicorn.arbiter import Arbiter
+from uvicorn.server import Server
+from uvicorn_worker import UvicornWorker
+
+
+class DrainingServer(Server):
+    """
+    Uvicorn server die een recycle van de app (api.analyze.recycle_requested) afhandelt:
+    eerst stoppen met accepteren, dan wachten tot lopende requests klaar zijn en de
+    verbindingen gesloten (responses hebben dan Connection: close), daarna pas stoppen
+    """
+
+    drain_started = None
+
+    async def on_tick(self, counter):
+        if await super().on_tick(counter):
+            return True
+        app_module = sys.modules.get("api.analyze")
+        if not getattr(app_module, "recycle_requested", False):
+            return False
+
+        now = time.monotonic()
+        if self.drain_started is None:
+            self.drain_started = now
+            # Sluit alleen de kopieën van deze worker (zie RecyclingUvicornWorker); de andere
+            # workers accepteren gewoon door op dezelfde socket
+            for server in self.servers:
+                server.close()
+        if not self.server_state.connections:
+            return True
+        # Idle keep-alive verbindingen sluit uvicorn zelf na timeout_keep_alive
+        return not self.server_state.tasks and now - self.drain_started > self.config.timeout_keep_alive + 1
+
+
+class RecyclingUvicornWorker(UvicornWorker):
+    """
+    UvicornWorker met DrainingServer (zelfde opbouw als UvicornWorker._serve, daarom is
+    uvicorn-worker in requirements.txt op een minor versie vastgezet)
+
+    De server krijgt kopieën (dup) van de listening sockets: DrainingServer kan die sluiten
+    om te stoppen met accepteren, terwijl de originele file descriptors van gunicorn blijven
+    en gunicorn ze zelf bij het afsluiten sluit.
+    """
+
+    async def _serve(self):
+        self.config.app = self.wsgi
+        server = DrainingServer(config=self.config)
+        self._install_sigquit_handler()
+        sockets = [socket.fromfd(sock.fileno(), sock.family, sock.type) for sock in self.sockets]
+        await server.serve(sockets=sockets)
+        if not server.started:
+            sys.exit(Arbiter.WORKER_BOOT_ERROR)
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = RecyclingUvicornWorker
+workers = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+
+# App (en librosa/numba) laden in het parent proces, vóór het forken
+preload_app = True
+
+timeout = int(os.environ.get("WORKER_TIMEOUT", "120"))
+# Ruim boven de langste analyse, zodat lopende requests bij recycle/deploy niet afgebroken worden
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", "60"))
+keepalive = 5
+
+# Worker recycling gebeurt in de app (telt alleen analyses, niet health checks);
+# doorgeven via environment zodat de geforkte workers het overnemen
+os.environ.setdefault("MAX_ANALYSES_PER_WORKER", "200")
+os.environ.setdefault("MAX_ANALYSES_JITTER", "20")
+
+accesslog = "-"
+
+
+def on_starting(server):
+    """Warm de analyzer op in het parent proces (na preload, vóór het forken)"""
+    from python.music_analyzer import warmup
+
+    server.log.info("Warming up analyzer kernels...")
+    warmup()
+    # Objecten van het parent proces buiten de GC houden, zodat de GC in de workers
+    # die pagina's niet aanraakt en copy-on-write gedeeld geheugen gedeeld blijft
+    gc.freeze()
+    server.log.info("Analyzer warm, forking workers")
+
+
+def post_fork(server, worker):
+    """Markeer het proces als pre-fork worker, zodat de app zichzelf mag recyclen"""
+    os.environ["OPPERBEAT_PREFORK_WORKER"] = "1"
+
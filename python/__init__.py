@@ -1,27 +1,40 @@
 """
 Python music analyzer module
+
+Exports worden pas bij gebruik geïmporteerd (PEP 562), zodat `import python` of
+`python -m python` niet direct librosa en alle analyse modules laadt.
 """
 
-from .music_analyzer import (
-    analyze_audio,
-    analyze_audio_simple,
-    detect_bpm_accurate,
-    detect_key_accurate,
-    get_bitrate,
-    get_song_name,
-    extract_waveform
-)
+import importlib
+
+# Publieke naam -> submodule waar die gedefinieerd is
+_EXPORTS = {
+    'analyze_audio': 'music_analyzer',
+    'analyze_audio_simple': 'music_analyzer',
+    'iter_analysis': 'music_analyzer',
+    'iter_analysis_simple': 'music_analyzer',
+    'detect_bpm_accurate': 'music_analyzer',
+    'detect_key_accurate': 'music_analyzer',
+    'get_bitrate': 'music_analyzer',
+    'get_song_name': 'music_analyzer',
+    'read_metadata': 'music_analyzer',
+    'extract_waveform': 'music_analyzer',
+    'warmup': 'music_analyzer',
+    'encode_result': 'encoding',
+    'analyze_batch': 'batch',
+    'analyze_mix': 'mix_analysis'
+}
 
-__all__ = [
-    'analyze_audio',
-    'analyze_audio_simple',
-    'detect_bpm_accurate',
-    'detect_key_accurate',
-    'get_bitrate',
-    'get_song_name',
-    'extract_waveform'
-]
+__all__ = list(_EXPORTS)
 
 
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
 
 
+def __dir__():
+    return sorted(list(globals()) + __all__)
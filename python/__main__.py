@@ -0,0 +1,9 @@
+"""
+Command line: python -m python scan <dir>
+"""
+
+import sys
+
+from .scanner import main
+
+sys.exit(main())
@@ -0,0 +1,340 @@
+"""
+Batch analyse voor korte samples en loops
+Decodeert veel korte clips, vult ze aan tot één 2-D array en berekent STFT, onset,
+chroma en RMS voor de hele batch in één gevectoriseerde aanroep. Voor one-shots en
+loops is dat vele malen sneller dan analyze_audio per bestand, waar de overhead
+(metadata, losse librosa aanroepen per feature) de eigenlijke DSP overheerst.
+
+Gebruik:
+    from python.batch import analyze_batch
+    results = analyze_batch(['kick_loop.wav', 'pad_loop.wav'])
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import librosa
+import numpy as np
+
+from .music_analyzer import KEYS, MAJOR_PROFILE, MINOR_PROFILE
+
+
+BATCH_SAMPLE_RATE = 22050
+BATCH_N_FFT = 2048
+BATCH_HOP_LENGTH = 512
+
+# Tempo bereik en prior (log-normaal rond 120 BPM, zoals librosa.feature.tempo)
+MIN_BPM = 30.0
+MAX_BPM = 300.0
+PRIOR_BPM = 120.0
+PRIOR_OCTAVES = 1.0
+
+# Dynamisch bereik voor de onset spectrogram (zoals librosa.power_to_db top_db)
+TOP_DB = 80.0
+
+# Maximum aantal (gepadde) samples per batch: clips x langste clip. De STFT en afgeleide
+# spectrogrammen kosten ~30 bytes per sample, dus 2^23 samples is ~250 MB per batch
+MAX_BATCH_SAMPLES = 1 << 23
+
+
+def _key_profiles():
+    """Matrix [24, 12] met alle geroteerde profielen: 12 majeur, daarna 12 minor (z-scored)"""
+    profiles = np.array(
+        [np.roll(MAJOR_PROFILE, k) for k in range(12)] + [np.roll(MINOR_PROFILE, k) for k in range(12)]
+    )
+    profiles = profiles - profiles.mean(axis=1, keepdims=True)
+    return profiles / profiles.std(axis=1, keepdims=True)
+
+
+KEY_PROFILES = _key_profiles()
+
+
+def estimate_key(chroma_mean):
+    """
+    Krumhansl-Schmuckler key detectie voor meerdere chroma vectoren tegelijk
+
+    Geeft dezelfde uitkomst als detect_key_accurate, maar als één matrixvermenigvuldiging
+    in plaats van 24 np.corrcoef aanroepen per clip.
+
+    Args:
+        chroma_mean: Gemiddelde chroma vectoren [n, 12]
+
+    Returns:
+        key_index: Index in KEYS [n]
+        is_minor: Boolean [n]
+        confidence: Betrouwbaarheid 0-1 [n]
+    """
+    chroma_mean = np.atleast_2d(chroma_mean)
+    centered = chroma_mean - chroma_mean.mean(axis=1, keepdims=True)
+    std = centered.std(axis=1, keepdims=True)
+    z = centered / np.where(std > 0, std, 1.0)
+
+    # Pearson correlatie met alle 24 profielen: [n, 24]
+    correlations = z @ KEY_PROFILES.T / 12
+    best = np.argmax(correlations, axis=1)
+    best_corr = correlations[np.arange(len(best)), best]
+
+    return best % 12, best >= 12, np.clip((best_corr + 1) / 2, 0, 1)
+
+
+def estimate_tempo(onset_env, sr, hop_length=BATCH_HOP_LENGTH, n_frames=None):
+    """
+    Globale tempo schatting voor meerdere onset envelopes tegelijk (autocorrelatie via FFT)
+
+    Args:
+        onset_env: Onset strength [n, frames] (mag zero-padded zijn)
+        sr: Sample rate
+        hop_length: Hop length van de onset envelope
+        n_frames: Aantal geldige frames per clip [n] (None = alle frames)
+
+    Returns:
+        bpm: Tempo in BPM [n] (float)
+        confidence: Autocorrelatie op de beat periode t.o.v. lag 0, 0-1 [n]
+    """
+    onset_env = np.atleast_2d(onset_env).astype(np.float64)
+    n, total = onset_env.shape
+    if n_frames is None:
+        n_frames = np.full(n, total)
+    n_frames = np.asarray(n_frames)
+    mask = np.arange(total)[None, :] < n_frames[:, None]
+
+    # Gemiddelde per clip eraf (alleen geldige frames), padding blijft 0
+    mean = (onset_env * mask).sum(axis=1, keepdims=True) / np.maximum(n_frames[:, None], 1)
+    centered = (onset_env - mean) * mask
+
+    # Autocorrelatie via FFT voor de hele batch
+    n_fft = 1 << int(np.ceil(np.log2(2 * total)))
+    spectrum = np.fft.rfft(centered, n=n_fft, axis=1)
+    autocorr = np.fft.irfft(spectrum * np.conj(spectrum), n=n_fft, axis=1)[:, :total]
+
+    # Normaliseer per lag op het aantal overlappende frames (ongebiased), dan op lag 0
+    lags = np.arange(total)
+    overlap = np.maximum(n_frames[:, None] - lags[None, :], 1)
+    autocorr = autocorr / overlap
+    # Stilte (geen onsets) heeft geen tempo
+    has_onsets = autocorr[:, 0] > 1e-10
+    autocorr = autocorr / np.maximum(autocorr[:, :1], 1e-10)
+
+    # Alleen lags binnen het BPM bereik, gewogen met de tempo prior
+    frame_rate = sr / hop_length
+    min_lag = max(1, int(np.floor(frame_rate * 60 / MAX_BPM)))
+    max_lag = min(total - 2, int(np.ceil(frame_rate * 60 / MIN_BPM)))
+    if max_lag <= min_lag:
+        return np.zeros(n), np.zeros(n)
+
+    candidate_lags = lags[min_lag:max_lag + 1]
+    candidate_bpm = 60 * frame_rate / candidate_lags
+    prior = np.exp(-0.5 * (np.log2(candidate_bpm / PRIOR_BPM) / PRIOR_OCTAVES) ** 2)
+    # Lags langer dan de helft van een clip zijn onbetrouwbaar
+    valid = candidate_lags[None, :] <= (n_frames[:, None] // 2)
+    weighted = np.where(valid, autocorr[:, min_lag:max_lag + 1] * prior[None, :], -np.inf)
+
+    best = np.argmax(weighted, axis=1)
+    has_tempo = np.isfinite(weighted[np.arange(n), best]) & has_onsets
+    best_lag = (best + min_lag).astype(np.float64)
+
+    # Parabolische interpolatie rond de piek voor sub-frame precisie
+    rows = np.arange(n)
+    idx = np.clip(best + min_lag, 1, total - 2)
+    left, center, right = autocorr[rows, idx - 1], autocorr[rows, idx], autocorr[rows, idx + 1]
+    denominator = left - 2 * center + right
+    offset = np.divide(0.5 * (left - right), denominator, out=np.zeros(n), where=np.abs(denominator) > 1e-10)
+    best_lag = best_lag + np.clip(offset, -0.5, 0.5)
+
+    bpm = np.where(has_tempo, 60 * frame_rate / best_lag, 0.0)
+    confidence = np.where(has_tempo, np.clip(center, 0, 1), 0.0)
+    return bpm, confidence
+
+
+def batch_descriptors(clips, sr=BATCH_SAMPLE_RATE, n_fft=BATCH_N_FFT, hop_length=BATCH_HOP_LENGTH):
+    """
+    Bereken ruwe descriptors voor een batch clips in één gevectoriseerde aanroep
+
+    Args:
+        clips: Lijst van mono audio arrays (mogen verschillende lengtes hebben)
+        sr: Sample rate van alle clips
+        n_fft: FFT grootte
+        hop_length: Hop length
+
+    Returns:
+        Dictionary met numpy arrays (eerste as = clip): bpm, bpm_confidence,
+        chroma_mean [n, 12], energy (gemiddelde RMS), lengths (in samples)
+    """
+    lengths = np.array([len(clip) for clip in clips])
+    # Minimaal één FFT frame, zodat ook hele korte one-shots werken
+    batch = np.zeros((len(clips), max(int(lengths.max()), n_fft)), dtype=np.float32)
+    for i, clip in enumerate(clips):
+        batch[i, :len(clip)] = clip
+
+    # Eén STFT voor de hele batch: [n, 1 + n_fft/2, frames]
+    stft = librosa.stft(batch, n_fft=n_fft, hop_length=hop_length)
+    magnitude = np.abs(stft)
+    power = magnitude ** 2
+
+    frames = power.shape[-1]
+    n_frames = np.minimum(1 + lengths // hop_length, frames)
+    mask = np.arange(frames)[None, :] < n_frames[:, None]
+
+    # Onset strength uit log-mel spectrogram, dynamisch bereik per clip (niet per batch)
+    mel_db = librosa.power_to_db(librosa.feature.melspectrogram(S=power, sr=sr), top_db=None)
+    mel_db = np.maximum(mel_db, mel_db.max(axis=(-2, -1), keepdims=True) - TOP_DB)
+    onset_env = librosa.onset.onset_strength(S=mel_db, sr=sr, hop_length=hop_length) * mask
+
+    # Chroma en RMS, gemiddeld over alleen de geldige frames
+    # tuning=0: tuning schatten (piptrack) kost meer dan de rest van de batch samen en zou
+    # bovendien één tuning voor alle clips opleveren; samples zijn vrijwel altijd op A440
+    chroma = librosa.feature.chroma_stft(S=power, sr=sr, n_fft=n_fft, hop_length=hop_length, tuning=0.0)
+    chroma_mean = (chroma * mask[:, None, :]).sum(axis=-1) / n_frames[:, None]
+    rms = librosa.feature.rms(S=magnitude, frame_length=n_fft, hop_length=hop_length)[:, 0, :]
+    energy = (rms * mask).sum(axis=-1) / n_frames
+
+    bpm, bpm_confidence = estimate_tempo(onset_env, sr, hop_length, n_frames)
+
+    return {
+        "bpm": bpm,
+        "bpm_confidence": bpm_confidence,
+        "chroma_mean": chroma_mean,
+        "energy": energy,
+        "lengths": lengths
+    }
+
+
+def extract_batch_features(clips, sr=BATCH_SAMPLE_RATE, n_fft=BATCH_N_FFT, hop_length=BATCH_HOP_LENGTH):
+    """
+    Bereken BPM, key en energie voor een batch clips in één gevectoriseerde aanroep
+
+    Args:
+        clips: Lijst van mono audio arrays (mogen verschillende lengtes hebben)
+        sr: Sample rate van alle clips
+        n_fft: FFT grootte
+        hop_length: Hop length
+
+    Returns:
+        Lijst dictionaries (zelfde volgorde als clips) met: bpm, bpm_confidence, key,
+        key_confidence, energy, energy_db, duration
+    """
+    if not clips:
+        return []
+
+    descriptors = batch_descriptors(clips, sr=sr, n_fft=n_fft, hop_length=hop_length)
+    bpm, energy = descriptors["bpm"], descriptors["energy"]
+    key_index, is_minor, key_confidence = estimate_key(descriptors["chroma_mean"])
+
+    results = []
+    for i in range(len(clips)):
+        mode = 'minor' if is_minor[i] else 'major'
+        results.append({
+            "bpm": int(round(bpm[i])) if bpm[i] > 0 else None,
+            "bpm_confidence": round(float(descriptors["bpm_confidence"][i]), 3),
+            "key": f"{KEYS[key_index[i]]} {mode}",
+            "key_confidence": round(float(key_confidence[i]), 3),
+            "energy": round(float(energy[i]), 4),
+            "energy_db": round(float(20 * np.log10(max(energy[i], 1e-10))), 2),
+            "duration": round(float(descriptors["lengths"][i] / sr), 3)
+        })
+    return results
+
+
+def _load_clip(filename, sample_rate, max_duration):
+    """Decodeer één clip; fouten worden als resultaat teruggegeven i.p.v. de batch te breken"""
+    try:
+        y, _ = librosa.load(filename, sr=sample_rate, duration=max_duration)
+        return y, None
+    except Exception as e:
+        return None, str(e)
+
+
+def _clip_length(filename, sample_rate, max_duration):
+    """
+    Verwachte lengte in samples na decoderen, uit de header (zonder de audio te laden)
+
+    Is de duur niet te bepalen, dan de bovengrens (max_duration) of None.
+    """
+    try:
+        duration = librosa.get_duration(path=filename)
+    except Exception:
+        duration = None
+    if max_duration is not None:
+        duration = max_duration if duration is None else min(duration, max_duration)
+    return None if duration is None else int(np.ceil(duration * sample_rate))
+
+
+def plan_batches(lengths, batch_size=64, max_batch_samples=MAX_BATCH_SAMPLES):
+    """
+    Verdeel clips over batches: op lengte gesorteerd (minder padding), maximaal
+    batch_size clips en maximaal max_batch_samples gepadde samples per batch
+
+    Args:
+        lengths: Lengte van elke clip in samples
+        batch_size: Maximum aantal clips per batch
+        max_batch_samples: Maximum clips x langste clip per batch (een clip die
+            alleen al langer is krijgt een eigen batch)
+
+    Returns:
+        Lijst van lijsten met indices in lengths
+    """
+    batches = []
+    current = []
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # Gesorteerd, dus de nieuwe clip is de langste van de batch
+        if current and (len(current) >= batch_size or (len(current) + 1) * lengths[i] > max_batch_samples):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def analyze_batch(filenames, sample_rate=BATCH_SAMPLE_RATE, max_duration=30.0, batch_size=64, workers=4,
+                  max_batch_samples=MAX_BATCH_SAMPLES):
+    """
+    Analyseer veel korte bestanden (samples, loops, one-shots) als batch
+
+    De lengtes komen eerst uit de headers; daarmee worden de batches gepland (zie
+    plan_batches). Daarna wordt per batch parallel gedecodeerd en gevectoriseerd
+    geanalyseerd, terwijl de volgende batch al decodeert. Er is dus hooguit audio van
+    twee batches in het geheugen, ongeacht het aantal bestanden.
+
+    Args:
+        filenames: Lijst van paden naar audio bestanden
+        sample_rate: Sample rate voor analyse (default: 22050)
+        max_duration: Maximum duur per clip in seconden (None = volledig bestand)
+        batch_size: Maximum aantal clips per gevectoriseerde aanroep
+        workers: Aantal threads voor het decoderen
+        max_batch_samples: Maximum gepadde samples per batch (begrenst het geheugen)
+
+    Returns:
+        Lijst dictionaries (zelfde volgorde als filenames) met: filename, bpm, bpm_confidence,
+        key, key_confidence, energy, energy_db, duration (of 'error' bij een decode fout)
+    """
+    filenames = [str(filename) for filename in filenames]
+    results = [{"filename": Path(filename).name} for filename in filenames]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        lengths = list(executor.map(lambda f: _clip_length(f, sample_rate, max_duration), filenames))
+        # Onbekende lengte (geen max_duration): in een eigen batch
+        lengths = [max_batch_samples if length is None else length for length in lengths]
+        batches = plan_batches(lengths, batch_size, max_batch_samples)
+
+        def decode(batch):
+            return [executor.submit(_load_clip, filenames[i], sample_rate, max_duration) for i in batch]
+
+        pending = decode(batches[0]) if batches else []
+        for number, batch in enumerate(batches):
+            decoded = [future.result() for future in pending]
+            # Volgende batch alvast decoderen tijdens de analyse van deze
+            pending = decode(batches[number + 1]) if number + 1 < len(batches) else []
+
+            clips, indices = [], []
+            for i, (y, error) in zip(batch, decoded):
+                if error is not None:
+                    results[i]["error"] = error
+                else:
+                    clips.append(y)
+                    indices.append(i)
+            if clips:
+                for i, clip_features in zip(indices, extract_batch_features(clips, sr=sample_rate)):
+                    results[i].update(clip_features)
+            del decoded, clips
+
+    return results
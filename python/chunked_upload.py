@@ -0,0 +1,671 @@
+"""
+Hervatbare chunked uploads met analyse die al tijdens het uploaden begint
+
+Een upload bestaat uit een sessie op schijf (map met meta.json en het audiobestand; de grootte
+van het bestand is de bevestigde offset). Elke chunk wordt aan het bestand toegevoegd én
+doorgegeven aan een live pipeline in deze worker, die de audio direct decodeert en features
+accumuleert (onset envelope, chroma som en een gedecimeerde waveform). Bij het afronden
+zijn alleen nog de tempo/key schatting en de metadata nodig, zodat upload en analyse overlappen.
+
+Decoderen: PCM/float WAV met een ingebouwde incrementele parser, andere formaten via een
+ffmpeg pipe (stdin -> PCM). Is er geen live pipeline (ffmpeg ontbreekt, chunks kwamen binnen
+op een andere worker, herstart, formaat niet te streamen), dan wordt het volledige bestand
+bij het afronden geanalyseerd met analyze_audio_simple.
+
+Let op: de live pipeline gebruikt de snelle schatters van python/batch.py (één autocorrelatie
+voor het tempo, chroma zonder tuning schatting), de volledige analyse detect_bpm_accurate en
+detect_key_accurate. BPM en key komen meestal overeen, maar de confidences hebben een andere
+schaal. Het resultaat bevat daarom analysis_method ('live' of 'full'). Met een fingerprint
+index zoeken beide paden een eerder geanalyseerde opname op, maar alleen volledige analyses
+worden opgeslagen, zodat /api/analyze nooit waarden van de snelle schatters hergebruikt.
+
+Gebruik:
+    from python.chunked_upload import create_upload, append_chunk, complete_upload
+    upload = create_upload('track.wav', size=len(data))
+    offset = 0
+    for chunk in chunks:
+        offset = append_chunk(upload['upload_id'], offset, chunk)['offset']
+    result, pipelined = complete_upload(upload['upload_id'], include_waveform=True)
+"""
+
+import json
+import os
+import queue
+import re
+import secrets
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+import librosa
+import numpy as np
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+try:
+    import soxr
+    SOXR_AVAILABLE = True
+except ImportError:
+    SOXR_AVAILABLE = False
+
+from .batch import BATCH_HOP_LENGTH, BATCH_N_FFT, TOP_DB, estimate_key, estimate_tempo
+from .fingerprint import compute_fingerprint, find_match, load_fingerprint_index_cached
+from .music_analyzer import KEYS, analyze_audio_simple, extract_waveform, read_metadata
+
+
+UPLOAD_DIR = os.environ.get("OPPERBEAT_UPLOAD_DIR") or os.path.join(tempfile.gettempdir(), "opperbeat_uploads")
+# Onafgeronde sessies worden na een dag opgeruimd
+SESSION_TTL_SECONDS = 24 * 3600
+# Een live pipeline zonder nieuwe chunks wordt na 10 minuten gestopt (sessie blijft bestaan)
+PIPELINE_IDLE_SECONDS = 600
+# Maximaal aantal gelijktijdige live pipelines per worker (elk met een eigen thread/ffmpeg proces)
+MAX_LIVE_PIPELINES = int(os.environ.get("MAX_LIVE_PIPELINES", "8"))
+# Maximale wachttijd bij het afronden tot de pipeline alle audio verwerkt heeft
+PIPELINE_FINISH_TIMEOUT = 60.0
+
+PIPELINE_SAMPLE_RATE = 22050
+# Bewaar 1 op de 16 samples voor de waveform (~1.4 kHz, ruim genoeg voor 5000 punten)
+WAVEFORM_DECIMATION = 16
+# Decodeer ffmpeg output in blokken van ~2 seconden
+PCM_BLOCK_SAMPLES = 2 * PIPELINE_SAMPLE_RATE
+
+_UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+_META_FILENAME = "meta.json"
+
+
+class UploadNotFound(Exception):
+    """Onbekende (of verlopen) upload sessie"""
+
+
+class OffsetMismatch(Exception):
+    """Chunk offset komt niet overeen met de bevestigde offset van de sessie"""
+
+    def __init__(self, offset, message=None):
+        super().__init__(message or f"Verwachte offset {offset}")
+        self.offset = offset
+
+
+class IncrementalFeatures:
+    """
+    Accumuleer analyse features over opeenvolgende blokken mono audio
+
+    Frames lopen door over blokgrenzen (de staart van elk blok wordt bewaard), zodat het
+    resultaat niet afhangt van hoe de audio in chunks binnenkomt. Per frame blijft alleen
+    de onset waarde over; chroma wordt direct opgeteld.
+    """
+
+    def __init__(self, sr=PIPELINE_SAMPLE_RATE, n_fft=BATCH_N_FFT, hop_length=BATCH_HOP_LENGTH):
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft)
+        self.chroma_basis = librosa.filters.chroma(sr=sr, n_fft=n_fft, tuning=0.0)
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.previous_mel_db = None
+        self.max_db = -np.inf
+        self.onset = []
+        self.chroma_sum = np.zeros(12)
+        self.n_frames = 0
+        self.total_samples = 0
+        self.waveform = []
+
+    def add(self, samples):
+        """Verwerk een blok mono float32 audio op self.sr"""
+        if not len(samples):
+            return
+        # Waveform: elke WAVEFORM_DECIMATION-de sample, doorlopend over blokgrenzen
+        self.waveform.append(samples[(-self.total_samples) % WAVEFORM_DECIMATION::WAVEFORM_DECIMATION].copy())
+        self.total_samples += len(samples)
+
+        self.buffer = np.concatenate([self.buffer, samples])
+        if len(self.buffer) < self.n_fft:
+            return
+        frames = 1 + (len(self.buffer) - self.n_fft) // self.hop_length
+        used = self.n_fft + (frames - 1) * self.hop_length
+        power = np.abs(librosa.stft(self.buffer[:used], n_fft=self.n_fft, hop_length=self.hop_length,
+                                    center=False)) ** 2
+        self.buffer = self.buffer[frames * self.hop_length:]
+
+        # Onset strength: spectral flux van het log-mel spectrogram (zoals batch_descriptors),
+        # met het dynamisch bereik begrensd t.o.v. het hoogste niveau tot nu toe
+        mel_db = librosa.power_to_db(self.mel_basis @ power, top_db=None)
+        self.max_db = max(self.max_db, float(mel_db.max()))
+        mel_db = np.maximum(mel_db, self.max_db - TOP_DB)
+        previous = mel_db[:, :1] if self.previous_mel_db is None else self.previous_mel_db
+        flux = np.maximum(0.0, mel_db - np.concatenate([previous, mel_db[:, :-1]], axis=1))
+        self.onset.append(flux.mean(axis=0))
+        self.previous_mel_db = mel_db[:, -1:]
+
+        # Chroma per frame genormaliseerd (zoals chroma_stft), daarna opgeteld
+        chroma = self.chroma_basis @ power
+        self.chroma_sum += (chroma / np.maximum(chroma.max(axis=0, keepdims=True), 1e-10)).sum(axis=1)
+        self.n_frames += frames
+
+    def result(self, waveform_samples=5000, waveform_as_array=False):
+        """
+        Schat tempo en key uit de geaccumuleerde features
+
+        Returns:
+            Dictionary met: bpm, bpm_confidence, key, mode, key_full, key_confidence,
+            analyzed_duration, waveform
+        """
+        if self.n_frames == 0:
+            raise ValueError("Te weinig audio ontvangen voor analyse")
+
+        onset_env = np.concatenate(self.onset)
+        bpm, bpm_confidence = estimate_tempo(onset_env, self.sr, self.hop_length)
+        key_index, is_minor, key_confidence = estimate_key(self.chroma_sum / self.n_frames)
+
+        waveform = extract_waveform(np.concatenate(self.waveform), self.sr, max_samples=waveform_samples,
+                                    as_array=waveform_as_array)
+        waveform["original_samples"] = int(self.total_samples)
+        waveform["downsampled"] = self.total_samples > waveform["waveform_samples"]
+
+        mode = "minor" if is_minor[0] else "major"
+        return {
+            "bpm": int(round(bpm[0])) if bpm[0] > 0 else None,
+            "bpm_confidence": round(float(bpm_confidence[0]), 3),
+            "key": KEYS[key_index[0]],
+            "mode": mode,
+            "key_full": f"{KEYS[key_index[0]]} {mode}",
+            "key_confidence": round(float(key_confidence[0]), 3),
+            "analyzed_duration": self.total_samples / self.sr,
+            "waveform": waveform
+        }
+
+
+class _WavStreamDecoder:
+    """Incrementele RIFF/WAVE parser voor PCM (8/16/24/32 bit) en float (32/64 bit) audio"""
+
+    def __init__(self, sr):
+        self.sr = sr
+        self.header = b""
+        self.in_header = True
+        self.remaining = None
+        self.pending = b""
+        self.format = None
+        self.resampler = None
+
+    def _parse_header(self):
+        """Lees chunks tot en met de 'data' header; geeft de positie van de audio, of None als er nog bytes ontbreken"""
+        if len(self.header) >= 12 and (self.header[:4] != b"RIFF" or self.header[8:12] != b"WAVE"):
+            raise ValueError("Geen RIFF/WAVE bestand")
+        position = 12
+        while len(self.header) >= position + 8:
+            chunk_id, chunk_size = struct.unpack("<4sI", self.header[position:position + 8])
+            body = position + 8
+            if chunk_id == b"data":
+                if self.format is None:
+                    raise ValueError("WAV 'data' chunk zonder 'fmt ' chunk")
+                # Gestreamde WAV's hebben soms grootte 0 of 0xFFFFFFFF: lees dan tot het einde
+                self.remaining = chunk_size if 0 < chunk_size < 0xFFFFFFFF else None
+                self.in_header = False
+                return body
+            if len(self.header) < body + chunk_size:
+                return None
+            if chunk_id == b"fmt ":
+                self._parse_format(self.header[body:body + chunk_size])
+            position = body + chunk_size + (chunk_size & 1)
+        return None
+
+    def _parse_format(self, fmt):
+        audio_format, channels, native_sr, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+        if audio_format == 0xFFFE and len(fmt) >= 26:
+            # WAVE_FORMAT_EXTENSIBLE: het echte formaat staat in de eerste 2 bytes van de subformat GUID
+            audio_format = struct.unpack("<H", fmt[24:26])[0]
+        if (audio_format, bits) not in ((1, 8), (1, 16), (1, 24), (1, 32), (3, 32), (3, 64)):
+            raise ValueError(f"WAV formaat {audio_format} met {bits} bits niet ondersteund voor streaming")
+        if native_sr != self.sr:
+            if not SOXR_AVAILABLE:
+                raise ValueError("Resampling vereist soxr")
+            self.resampler = soxr.ResampleStream(native_sr, self.sr, 1, dtype="float32")
+        self.format = (audio_format, channels, bits, block_align)
+
+    def _to_float(self, data):
+        audio_format, channels, bits, _ = self.format
+        if audio_format == 3:
+            samples = np.frombuffer(data, dtype="<f4" if bits == 32 else "<f8").astype(np.float32)
+        elif bits == 8:
+            samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+        elif bits == 24:
+            raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+            values = (raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)) << 8 >> 8
+            samples = values.astype(np.float32) / 2 ** 23
+        else:
+            dtype = "<i2" if bits == 16 else "<i4"
+            samples = np.frombuffer(data, dtype=dtype).astype(np.float32) / 2 ** (bits - 1)
+        return samples.reshape(-1, channels).mean(axis=1).astype(np.float32, copy=False)
+
+    def decode(self, data):
+        """Geef de mono audio (op self.sr) die met deze bytes compleet is geworden"""
+        if self.in_header:
+            self.header += data
+            position = self._parse_header()
+            if position is None:
+                return np.zeros(0, dtype=np.float32)
+            data, self.header = self.header[position:], b""
+        if self.remaining is not None:
+            # Alles na de data chunk (bijv. LIST metadata) is geen audio
+            data = data[:self.remaining]
+            self.remaining -= len(data)
+        data = self.pending + data
+        block_align = self.format[3]
+        usable = len(data) - len(data) % block_align
+        self.pending = data[usable:]
+        samples = self._to_float(data[:usable])
+        if self.resampler is not None:
+            samples = self.resampler.resample_chunk(samples)
+        return samples
+
+    def finish(self):
+        if self.in_header:
+            raise ValueError("Onvolledige WAV header")
+        if self.resampler is not None:
+            return self.resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+        return np.zeros(0, dtype=np.float32)
+
+
+class LivePipeline(ABC):
+    """
+    Decodeer en analyseer binnenkomende chunks op een achtergrond thread
+
+    feed() zet chunks in een begrensde queue (backpressure als de analyse achterloopt);
+    offset houdt bij tot waar de pipeline de upload gezien heeft. Subclasses implementeren
+    _decode en eventueel _finish (einde van de upload) en _close (opruimen).
+    """
+
+    def __init__(self, sr=PIPELINE_SAMPLE_RATE):
+        self.features = IncrementalFeatures(sr)
+        self.offset = 0
+        self.error = None
+        self.last_activity = time.monotonic()
+        self.chunks = queue.Queue(maxsize=8)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def feed(self, offset, data):
+        """Geef een chunk door; False als de pipeline niet (meer) aansluit op de upload"""
+        if self.error is not None or offset != self.offset or not self._put(data):
+            return False
+        self.offset += len(data)
+        self.last_activity = time.monotonic()
+        return True
+
+    def finish(self, timeout=PIPELINE_FINISH_TIMEOUT):
+        """Wacht tot alle chunks verwerkt zijn en geef de features terug"""
+        self._put(None)
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            self.abort()
+            raise TimeoutError("Live pipeline niet op tijd klaar")
+        if self.error is not None:
+            raise self.error
+        return self.features
+
+    def _put(self, item):
+        """Zet item in de queue; geeft False als de pipeline thread intussen gestopt is"""
+        while True:
+            try:
+                self.chunks.put(item, timeout=1.0)
+                return True
+            except queue.Full:
+                if self.error is not None or not self.thread.is_alive():
+                    return False
+
+    def abort(self):
+        self.error = self.error or RuntimeError("Pipeline afgebroken")
+        try:
+            self.chunks.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def _run(self):
+        try:
+            while True:
+                data = self.chunks.get()
+                if data is None or self.error is not None:
+                    break
+                self._decode(data)
+            if self.error is None:
+                self._finish()
+        except Exception as e:
+            self.error = e
+        finally:
+            self._close()
+
+    @abstractmethod
+    def _decode(self, data):
+        """Decodeer een chunk en geef de audio aan self.features (op de pipeline thread)"""
+
+    def _finish(self):
+        pass
+
+    def _close(self):
+        pass
+
+
+class _WavPipeline(LivePipeline):
+    def __init__(self, sr=PIPELINE_SAMPLE_RATE):
+        self.decoder = _WavStreamDecoder(sr)
+        super().__init__(sr)
+
+    def _decode(self, data):
+        self.features.add(self.decoder.decode(data))
+
+    def _finish(self):
+        self.features.add(self.decoder.finish())
+
+
+class _FfmpegPipeline(LivePipeline):
+    """Pipe chunks door ffmpeg (stdin) en lees mono float32 PCM terug (stdout)"""
+
+    def __init__(self, ffmpeg, sr=PIPELINE_SAMPLE_RATE):
+        self.process = subprocess.Popen(
+            [ffmpeg, '-v', 'error', '-i', 'pipe:0', '-f', 'f32le', '-ac', '1', '-ar', str(sr), 'pipe:1'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        super().__init__(sr)
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def _read(self):
+        try:
+            block_bytes = PCM_BLOCK_SAMPLES * 4
+            while True:
+                data = self.process.stdout.read(block_bytes)
+                if not data:
+                    break
+                self.features.add(np.frombuffer(data[:len(data) - len(data) % 4], dtype=np.float32))
+        except Exception as e:
+            self.error = self.error or e
+
+    def _decode(self, data):
+        self.process.stdin.write(data)
+
+    def _finish(self):
+        self.process.stdin.close()
+        self.reader.join()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg gestopt met exit code {self.process.returncode}")
+
+    def _close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+
+def start_pipeline(filename, sr=PIPELINE_SAMPLE_RATE):
+    """Start een live pipeline voor dit formaat, of None als streamend decoderen niet kan"""
+    if Path(filename).suffix.lower() in (".wav", ".wave"):
+        return _WavPipeline(sr)
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        return None
+    return _FfmpegPipeline(ffmpeg, sr)
+
+
+# Live pipelines van deze worker, per upload id
+_pipelines = {}
+_pipelines_lock = threading.Lock()
+
+
+def _session_dir(upload_id):
+    if not isinstance(upload_id, str) or not _UPLOAD_ID_PATTERN.match(upload_id):
+        raise UploadNotFound(upload_id)
+    path = os.path.join(UPLOAD_DIR, upload_id)
+    if not os.path.isdir(path):
+        raise UploadNotFound(upload_id)
+    return path
+
+
+def _load_meta(session_dir):
+    try:
+        with open(os.path.join(session_dir, _META_FILENAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        raise UploadNotFound(os.path.basename(session_dir))
+
+
+@contextmanager
+def _session_lock(session_dir):
+    """Exclusieve lock per sessie (chunks kunnen op verschillende workers binnenkomen)"""
+    if not FCNTL_AVAILABLE:
+        yield
+        return
+    with open(os.path.join(session_dir, ".lock"), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _status(meta, offset):
+    return {
+        "upload_id": meta["upload_id"],
+        "filename": meta["filename"],
+        "size": meta["size"],
+        "offset": offset
+    }
+
+
+def _drop_pipeline(upload_id):
+    with _pipelines_lock:
+        pipeline = _pipelines.pop(upload_id, None)
+    if pipeline is not None:
+        pipeline.abort()
+
+
+def sweep_uploads():
+    """Stop inactieve live pipelines en verwijder verlopen sessies"""
+    now = time.monotonic()
+    with _pipelines_lock:
+        idle = [upload_id for upload_id, pipeline in _pipelines.items()
+                if now - pipeline.last_activity > PIPELINE_IDLE_SECONDS]
+    for upload_id in idle:
+        _drop_pipeline(upload_id)
+
+    if not os.path.isdir(UPLOAD_DIR):
+        return
+    for upload_id in os.listdir(UPLOAD_DIR):
+        session_dir = os.path.join(UPLOAD_DIR, upload_id)
+        try:
+            # De lock file wordt bij elke chunk opnieuw geopend, dus de jongste mtime is de laatste activiteit
+            last_activity = max([os.path.getmtime(session_dir)] +
+                                [os.path.getmtime(os.path.join(session_dir, name)) for name in os.listdir(session_dir)])
+            if time.time() - last_activity > SESSION_TTL_SECONDS:
+                _drop_pipeline(upload_id)
+                shutil.rmtree(session_dir, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def create_upload(filename, size=None):
+    """
+    Maak een nieuwe upload sessie
+
+    Args:
+        filename: Originele bestandsnaam (de extensie bepaalt de decoder)
+        size: Totale grootte in bytes (optioneel; dan worden te lange en onvolledige uploads geweigerd)
+
+    Returns:
+        Status dictionary: upload_id, filename, size, offset
+    """
+    sweep_uploads()
+    safe_filename = "".join(c for c in (filename or "") if c.isalnum() or c in "._- ").strip(". ") or "audio_file"
+    if safe_filename == _META_FILENAME:
+        safe_filename = f"audio_{safe_filename}"
+    upload_id = secrets.token_hex(16)
+    session_dir = os.path.join(UPLOAD_DIR, upload_id)
+    os.makedirs(session_dir)
+
+    meta = {"upload_id": upload_id, "filename": safe_filename, "size": size, "created": time.time()}
+    open(os.path.join(session_dir, safe_filename), 'wb').close()
+    with open(os.path.join(session_dir, _META_FILENAME), 'w') as f:
+        json.dump(meta, f)
+    return _status(meta, 0)
+
+
+def upload_status(upload_id):
+    """Status van een sessie; offset is het aantal bevestigde bytes (hervat vanaf hier)"""
+    session_dir = _session_dir(upload_id)
+    meta = _load_meta(session_dir)
+    return _status(meta, os.path.getsize(os.path.join(session_dir, meta["filename"])))
+
+
+def append_chunk(upload_id, offset, data):
+    """
+    Voeg een chunk toe op de gegeven offset en geef hem door aan de live pipeline
+
+    Raises:
+        UploadNotFound: Onbekende sessie
+        OffsetMismatch: offset is niet de bevestigde offset (exception bevat de juiste offset)
+        ValueError: Chunk gaat voorbij de opgegeven totale grootte
+
+    Returns:
+        Status dictionary met de nieuwe offset
+    """
+    session_dir = _session_dir(upload_id)
+    with _session_lock(session_dir):
+        meta = _load_meta(session_dir)
+        data_path = os.path.join(session_dir, meta["filename"])
+        current = os.path.getsize(data_path)
+        if offset != current:
+            raise OffsetMismatch(current)
+        if meta["size"] is not None and current + len(data) > meta["size"]:
+            raise ValueError(f"Chunk gaat voorbij de opgegeven grootte van {meta['size']} bytes")
+
+        with open(data_path, 'ab') as f:
+            f.write(data)
+
+        with _pipelines_lock:
+            pipeline = _pipelines.get(upload_id)
+            if pipeline is None and offset == 0 and len(_pipelines) < MAX_LIVE_PIPELINES:
+                pipeline = start_pipeline(meta["filename"])
+                if pipeline is not None:
+                    _pipelines[upload_id] = pipeline
+        # Chunks die (deels) op een andere worker binnenkwamen: deze pipeline is niet meer bruikbaar
+        if pipeline is not None and not pipeline.feed(offset, data):
+            _drop_pipeline(upload_id)
+
+        return _status(meta, current + len(data))
+
+
+def _live_result(features, data_path, include_waveform, fingerprint_index):
+    """
+    Resultaat (velden van analyze_audio_simple) uit de live features
+
+    Een bekende opname uit de fingerprint index krijgt de opgeslagen (volledige) analyse.
+    Live resultaten zelf worden niet opgeslagen (andere schatters, zie de module docstring).
+    """
+    metadata = read_metadata(data_path)
+    duration = metadata["duration"] or features["analyzed_duration"]
+    result = {
+        "song_name": metadata["song_name"],
+        "duration": round(duration, 2),
+        "duration_formatted": f"{int(duration // 60)}:{int(duration % 60):02d}",
+        "bitrate": metadata["bitrate"]
+    }
+    if include_waveform:
+        result["waveform"] = features["waveform"]
+
+    # Zelfde lookup als iter_analysis
+    match = None
+    if fingerprint_index:
+        try:
+            fingerprint = compute_fingerprint(data_path, duration=duration)
+            match, similarity = find_match(load_fingerprint_index_cached(fingerprint_index), fingerprint, duration)
+        except Exception as e:
+            print(f"Waarschuwing: Fingerprint gefaald: {e}")
+
+    if match is not None:
+        stored = match["analysis"]
+        result.update({
+            "bpm": stored["bpm"],
+            "bpm_confidence": stored["bpm_confidence"],
+            "key": stored["key_full"],
+            "key_confidence": stored["key_confidence"],
+            "fingerprint_match": {
+                "similarity": round(similarity, 3),
+                "filename": match.get("filename"),
+                "analysis_method": match.get("analysis_method", "full")
+            }
+        })
+        return result
+
+    result.update({
+        "bpm": features["bpm"],
+        "bpm_confidence": features["bpm_confidence"],
+        "key": features["key_full"],
+        "key_confidence": features["key_confidence"]
+    })
+    return result
+
+
+def complete_upload(upload_id, include_waveform=False, waveform_samples=5000, waveform_as_array=False,
+                    fingerprint_index=None, **fallback_options):
+    """
+    Rond een upload af, geef het analyse resultaat terug en verwijder de sessie
+
+    Faalt de analyse, dan blijft de sessie bestaan (opnieuw afronden kan, anders ruimt
+    sweep_uploads hem na SESSION_TTL_SECONDS op).
+
+    Args:
+        upload_id: Id van de sessie
+        include_waveform: Of waveform data moet worden opgenomen (default: False)
+        waveform_samples: Maximum aantal samples voor waveform (default: 5000)
+        waveform_as_array: Waveform samples als numpy array i.p.v. list (default: False)
+        fingerprint_index: Pad naar fingerprint index (None = geen deduplicatie); beide paden zoeken
+                           op, alleen het volledige pad slaat op
+        **fallback_options: Extra argumenten voor analyze_audio_simple als er geen live pipeline is
+                            (bijv. sample_rate, max_duration)
+
+    Raises:
+        UploadNotFound: Onbekende sessie
+        OffsetMismatch: Nog niet alle bytes van de opgegeven grootte ontvangen
+
+    Returns:
+        result: Dictionary met de velden van analyze_audio_simple en analysis_method
+                ('live' of 'full', zie de module docstring)
+        pipelined: True als het resultaat uit de live pipeline komt
+    """
+    session_dir = _session_dir(upload_id)
+    with _session_lock(session_dir):
+        meta = _load_meta(session_dir)
+        data_path = os.path.join(session_dir, meta["filename"])
+        size = os.path.getsize(data_path)
+        if meta["size"] is not None and size != meta["size"]:
+            raise OffsetMismatch(size, f"Upload onvolledig: {size} van {meta['size']} bytes ontvangen")
+
+        with _pipelines_lock:
+            pipeline = _pipelines.pop(upload_id, None)
+
+        features = None
+        if pipeline is not None and pipeline.offset == size:
+            try:
+                features = pipeline.finish().result(waveform_samples, waveform_as_array)
+            except Exception as e:
+                print(f"Waarschuwing: Live pipeline gefaald, volledige analyse: {e}")
+        elif pipeline is not None:
+            pipeline.abort()
+
+        if features is None:
+            result = analyze_audio_simple(data_path, include_waveform=include_waveform,
+                                          waveform_samples=waveform_samples, waveform_as_array=waveform_as_array,
+                                          fingerprint_index=fingerprint_index, **fallback_options)
+            result["analysis_method"] = "full"
+        else:
+            result = _live_result(features, data_path, include_waveform, fingerprint_index)
+            result["analysis_method"] = "live"
+
+        shutil.rmtree(session_dir, ignore_errors=True)
+        return result, features is not None
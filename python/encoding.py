@@ -0,0 +1,353 @@
+"""
+Response encodings voor analyse resultaten
+Ondersteunt: JSON (orjson indien beschikbaar), MessagePack, een compact binair formaat
+met gekwantiseerde waveform (int8/int16) en gzip/brotli compressie.
+Voor gestreamde resultaten: NDJSON of server-sent events (één event per veldgroep).
+
+Gebruik:
+    from python.encoding import encode_result
+    body, media_type, headers = encode_result(result, accept="application/x-msgpack")
+"""
+
+import gzip
+import json
+import struct
+import numpy as np
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+
+MEDIA_TYPE_JSON = "application/json"
+MEDIA_TYPE_MSGPACK = "application/x-msgpack"
+MEDIA_TYPE_BINARY = "application/vnd.opperbeat.analysis"
+MEDIA_TYPE_NDJSON = "application/x-ndjson"
+MEDIA_TYPE_SSE = "text/event-stream"
+
+# Binair formaat: header + JSON metadata (zonder waveform samples) + ruwe little-endian array
+# Header: magic (4 bytes), versie (uint8), dtype code (uint8), gereserveerd (uint16),
+#         lengte metadata (uint32), aantal samples (uint32)
+BINARY_MAGIC = b"OPBA"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sBBHII")
+
+# Ondersteunde waveform dtypes: (numpy dtype, maximale integer waarde, code in binaire header)
+WAVEFORM_DTYPES = {
+    "int8": (np.int8, 127, 1),
+    "int16": (np.int16, 32767, 2),
+    "float32": (np.float32, None, 3),
+}
+DEFAULT_BINARY_DTYPE = "int16"
+
+# Kleine bodies niet comprimeren, de overhead is dan groter dan de winst
+MIN_COMPRESS_SIZE = 1024
+# Alleen tekst formaten comprimeren: msgpack en het binaire formaat bestaan vooral uit
+# (gekwantiseerde) waveform samples, waar gzip/brotli vrijwel niets wint maar wel tijd kost
+COMPRESSIBLE_MEDIA_TYPES = (MEDIA_TYPE_JSON,)
+
+
+def quantize_waveform(samples, dtype="int16"):
+    """
+    Kwantiseer waveform samples naar een compact numeriek type
+
+    De samples worden genormaliseerd op de piekwaarde zodat ook zachte tracks
+    het volledige bereik van int8/int16 gebruiken.
+
+    Args:
+        samples: Waveform samples (list of numpy array, floats in [-1, 1])
+        dtype: 'int8', 'int16' of 'float32'
+
+    Returns:
+        quantized: Numpy array van het gevraagde type
+        scale: Factor om terug te rekenen (sample = waarde * scale)
+    """
+    if dtype not in WAVEFORM_DTYPES:
+        raise ValueError(f"Ongeldig waveform dtype: {dtype}")
+
+    np_dtype, max_value, _ = WAVEFORM_DTYPES[dtype]
+    samples = np.asarray(samples, dtype=np.float32)
+
+    if max_value is None:
+        return samples, 1.0
+
+    peak = float(np.max(np.abs(samples))) if samples.size else 0.0
+    scale = peak / max_value if peak > 0 else 1.0
+    quantized = np.clip(np.round(samples / scale), -max_value, max_value).astype(np_dtype)
+
+    return quantized, scale
+
+
+def _json_default(value):
+    """Fallback serialisatie voor numpy types"""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (bytes, bytearray)):
+        return list(value)
+    raise TypeError(f"Type niet serialiseerbaar: {type(value).__name__}")
+
+
+def _split_waveform(result, waveform_dtype):
+    """
+    Splits waveform samples af van de rest van het resultaat
+
+    Returns:
+        meta: Kopie van het resultaat, waveform dict zonder samples (wel dtype/scale)
+        samples: Numpy array met (eventueel gekwantiseerde) samples, of None
+    """
+    waveform_data = result.get("waveform")
+    if not isinstance(waveform_data, dict) or "waveform" not in waveform_data:
+        return dict(result), None
+
+    samples, scale = quantize_waveform(waveform_data["waveform"], waveform_dtype)
+    waveform_meta = {k: v for k, v in waveform_data.items() if k != "waveform"}
+    waveform_meta["waveform_dtype"] = waveform_dtype
+    waveform_meta["waveform_scale"] = scale
+
+    meta = dict(result)
+    meta["waveform"] = waveform_meta
+    return meta, samples
+
+
+def encode_json(result, waveform_dtype=None):
+    """
+    Encodeer resultaat als JSON
+
+    Zonder waveform_dtype blijft de waveform een lijst floats (float32 precisie),
+    zodat bestaande clients ongewijzigd werken. Met waveform_dtype wordt een lijst
+    integers plus waveform_scale teruggegeven.
+
+    Returns:
+        body: JSON bytes
+    """
+    if waveform_dtype is None:
+        meta, samples = dict(result), None
+        waveform_data = result.get("waveform")
+        if isinstance(waveform_data, dict) and "waveform" in waveform_data:
+            samples = np.asarray(waveform_data["waveform"], dtype=np.float32)
+            meta["waveform"] = {**waveform_data, "waveform": samples}
+    else:
+        meta, samples = _split_waveform(result, waveform_dtype)
+        if samples is not None:
+            meta["waveform"]["waveform"] = samples
+
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(meta, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(meta, default=_json_default, separators=(",", ":")).encode("utf-8")
+
+
+def encode_msgpack(result, waveform_dtype=DEFAULT_BINARY_DTYPE):
+    """
+    Encodeer resultaat als MessagePack met waveform als ruwe little-endian bytes
+
+    Returns:
+        body: MessagePack bytes
+    """
+    if not MSGPACK_AVAILABLE:
+        raise RuntimeError("msgpack niet geïnstalleerd. Installeer via: pip install msgpack")
+
+    meta, samples = _split_waveform(result, waveform_dtype)
+    if samples is not None:
+        meta["waveform"]["waveform"] = samples.astype(samples.dtype.newbyteorder("<"), copy=False).tobytes()
+
+    return msgpack.packb(meta, default=_json_default, use_bin_type=True)
+
+
+def encode_binary(result, waveform_dtype=DEFAULT_BINARY_DTYPE):
+    """
+    Encodeer resultaat in het compacte binaire formaat (geen extra dependencies)
+
+    Layout: header | JSON metadata | waveform samples
+    De metadata wordt met spaties opgevuld tot een veelvoud van 8 bytes, zodat de
+    samples in de client direct als Int8Array/Int16Array/Float32Array te lezen zijn.
+
+    Returns:
+        body: Bytes
+    """
+    meta, samples = _split_waveform(result, waveform_dtype)
+    meta_bytes = json.dumps(meta, default=_json_default, separators=(",", ":")).encode("utf-8")
+
+    offset = BINARY_HEADER.size + len(meta_bytes)
+    meta_bytes += b" " * (-offset % 8)
+
+    if samples is None:
+        dtype_code, sample_count, sample_bytes = 0, 0, b""
+    else:
+        dtype_code = WAVEFORM_DTYPES[waveform_dtype][2]
+        sample_count = len(samples)
+        sample_bytes = samples.astype(samples.dtype.newbyteorder("<"), copy=False).tobytes()
+
+    header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, dtype_code, 0, len(meta_bytes), sample_count)
+    return header + meta_bytes + sample_bytes
+
+
+def _parse_header_values(header):
+    """
+    Parse een Accept/Accept-Encoding header naar [(waarde, q), ...] gesorteerd op q
+    """
+    values = []
+    for index, part in enumerate((header or "").split(",")):
+        fields = [field.strip() for field in part.split(";")]
+        if not fields[0]:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            values.append((fields[0].lower(), q, index))
+    # Hoogste q eerst, bij gelijke q de volgorde van de client
+    values.sort(key=lambda item: (-item[1], item[2]))
+    return [(value, q) for value, q, _ in values]
+
+
+def supported_media_types():
+    """Lijst van media types die deze installatie kan leveren"""
+    media_types = [MEDIA_TYPE_JSON, MEDIA_TYPE_BINARY]
+    if MSGPACK_AVAILABLE:
+        media_types.insert(1, MEDIA_TYPE_MSGPACK)
+    return media_types
+
+
+def negotiate_media_type(accept):
+    """
+    Kies response formaat op basis van de Accept header (default: JSON)
+    """
+    supported = supported_media_types()
+    for value, _ in _parse_header_values(accept):
+        if value in supported:
+            return value
+        if value in ("application/msgpack", "application/vnd.msgpack") and MSGPACK_AVAILABLE:
+            return MEDIA_TYPE_MSGPACK
+        if value in ("*/*", "application/*"):
+            return MEDIA_TYPE_JSON
+    return MEDIA_TYPE_JSON
+
+
+def negotiate_stream_type(accept):
+    """
+    Bepaal of de client een gestreamd resultaat wil (NDJSON of server-sent events)
+
+    Streaming en niet-gestreamde formaten worden in één pass op q-volgorde vergeleken:
+    alleen als een stream type de hoogste voorkeur heeft wordt er gestreamd
+    (bijv. niet bij "application/json, text/event-stream;q=0.1").
+
+    Returns:
+        MEDIA_TYPE_NDJSON, MEDIA_TYPE_SSE of None (geen streaming, gebruik negotiate_media_type)
+    """
+    supported = supported_media_types()
+    for value, _ in _parse_header_values(accept):
+        if value in (MEDIA_TYPE_NDJSON, "application/jsonl"):
+            return MEDIA_TYPE_NDJSON
+        if value == MEDIA_TYPE_SSE:
+            return MEDIA_TYPE_SSE
+        if value in supported or value in ("*/*", "application/*"):
+            return None
+        if value in ("application/msgpack", "application/vnd.msgpack") and MSGPACK_AVAILABLE:
+            return None
+    return None
+
+
+def encode_event(event, data, media_type=MEDIA_TYPE_NDJSON, waveform_dtype=None):
+    """
+    Encodeer één event van een gestreamd resultaat
+
+    NDJSON: {"event": ..., "data": {...}} per regel
+    SSE:    "event: ...\ndata: {...}\n\n"
+
+    Args:
+        event: Naam van het event (veldgroep, 'done' of 'error')
+        data: Velden van het event
+        media_type: MEDIA_TYPE_NDJSON of MEDIA_TYPE_SSE
+        waveform_dtype: Optionele kwantisatie van de waveform (zie encode_json)
+
+    Returns:
+        body: Bytes voor dit event
+    """
+    body = encode_json(data, waveform_dtype)
+    if media_type == MEDIA_TYPE_SSE:
+        return b"event: " + event.encode("utf-8") + b"\ndata: " + body + b"\n\n"
+    return b'{"event":' + json.dumps(event).encode("utf-8") + b',"data":' + body + b"}\n"
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    Kies content encoding op basis van de Accept-Encoding header
+
+    Returns:
+        'br', 'gzip' of None (geen compressie)
+    """
+    for value, _ in _parse_header_values(accept_encoding):
+        if value == "br" and BROTLI_AVAILABLE:
+            return "br"
+        if value in ("gzip", "x-gzip"):
+            return "gzip"
+        if value == "*":
+            return "br" if BROTLI_AVAILABLE else "gzip"
+    return None
+
+
+def compress(body, encoding):
+    """
+    Comprimeer body met de gegeven encoding ('br', 'gzip' of None)
+    """
+    if encoding == "br":
+        # Quality 5: goede verhouding tussen snelheid en grootte voor dynamische responses
+        return brotli.compress(body, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+def encode_body(result, media_type, waveform_dtype=None):
+    """
+    Encodeer resultaat naar het gegeven media type (zonder compressie)
+    """
+    if media_type == MEDIA_TYPE_MSGPACK:
+        return encode_msgpack(result, waveform_dtype or DEFAULT_BINARY_DTYPE)
+    if media_type == MEDIA_TYPE_BINARY:
+        return encode_binary(result, waveform_dtype or DEFAULT_BINARY_DTYPE)
+    return encode_json(result, waveform_dtype)
+
+
+def encode_result(result, accept=None, accept_encoding=None, waveform_dtype=None):
+    """
+    Encodeer analyse resultaat met content negotiation
+
+    Args:
+        result: Resultaat dictionary van analyze_audio(_simple)
+        accept: Waarde van de Accept header
+        accept_encoding: Waarde van de Accept-Encoding header
+        waveform_dtype: 'int8', 'int16' of 'float32' (None = default per formaat)
+
+    Returns:
+        body: Response bytes (alleen JSON wordt eventueel gecomprimeerd)
+        media_type: Gekozen media type
+        headers: Extra response headers (Content-Encoding, Vary)
+    """
+    media_type = negotiate_media_type(accept)
+    body = encode_body(result, media_type, waveform_dtype)
+
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    encoding = negotiate_encoding(accept_encoding)
+    if encoding and media_type in COMPRESSIBLE_MEDIA_TYPES and len(body) >= MIN_COMPRESS_SIZE:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+
+    return body, media_type, headers
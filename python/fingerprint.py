@@ -0,0 +1,344 @@
+"""
+Audio fingerprints voor het herkennen van dezelfde opname in verschillende encodings
+(bijv. MP3 320, een 128 kbps rip en een FLAC), zodat een bestaande analyse hergebruikt
+kan worden in plaats van de volledige pipeline opnieuw te draaien.
+
+Het fingerprint is gebaseerd op een kort chroma excerpt: per frame 12 bits voor het
+verschil tussen naburige toonklassen en 12 bits voor de verandering t.o.v. het vorige
+frame. Chroma is nauwelijks gevoelig voor bitrate en codec, dus de bits van
+verschillende encodings van dezelfde opname komen bijna volledig overeen.
+
+Stille frames hebben geen betekenisvolle chroma (alle bits gelijk), dus per frame wordt
+ook bijgehouden of er signaal is; alleen frames met signaal in beide fingerprints tellen
+mee. Korte bestanden (one-shots, korter dan het excerpt) worden niet gededupliceerd.
+
+De index is een JSONL bestand waar alleen aan toegevoegd wordt (één entry per regel).
+Een nieuwe opname kost één append, en processen die de index al geladen hebben lezen
+bij de volgende lookup alleen de nieuwe regels.
+
+Gebruik:
+    from python.music_analyzer import analyze_audio
+    result = analyze_audio('track.flac', fingerprint_index='fingerprints.jsonl')
+"""
+
+import base64
+import json
+import os
+from contextlib import contextmanager
+import librosa
+import numpy as np
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+
+FINGERPRINT_VERSION = 3
+FINGERPRINT_SAMPLE_RATE = 11025
+FINGERPRINT_N_FFT = 4096
+FINGERPRINT_HOP_LENGTH = 2048  # ~0.19 seconde per frame
+FINGERPRINT_BITS = 24
+
+# Excerpt: standaard 20 seconden vanaf 30 seconden (intro's zijn vaak stil of generiek)
+EXCERPT_OFFSET = 30.0
+EXCERPT_DURATION = 20.0
+
+# Minimale overeenkomst (fractie gelijke bits) voor een match; ongerelateerde audio zit rond 0.5
+MATCH_THRESHOLD = 0.85
+# Frames zachter dan dit (RMS in dBFS) tellen als stilte
+VOICED_RMS_DB = -45.0
+# Minimaal aantal frames met signaal (in beide fingerprints) voor een betrouwbare vergelijking (~9 s)
+MIN_VOICED_FRAMES = 50
+# Maximale verschuiving in frames (encoder delay/padding verschilt per codec)
+MAX_SHIFT = 3
+# Maximaal duurverschil in seconden tussen kandidaten
+DURATION_TOLERANCE = 2.0
+
+# Velden van de analyse die bij een match hergebruikt worden (de rest komt uit het bestand zelf)
+REUSABLE_FIELDS = ('bpm', 'bpm_confidence', 'key', 'mode', 'key_full', 'key_confidence')
+
+
+def excerpt_offset(duration, excerpt_duration=EXCERPT_DURATION):
+    """
+    Bepaal de start van het excerpt op basis van de duur
+
+    Voor korte tracks wordt het excerpt gecentreerd, zodat verschillende encodings
+    (met iets andere duur) vrijwel hetzelfde fragment gebruiken.
+    """
+    if duration is None:
+        return 0.0
+    return float(min(EXCERPT_OFFSET, max(0.0, (duration - excerpt_duration) / 2)))
+
+
+def fingerprint_eligible(duration, excerpt_duration=EXCERPT_DURATION):
+    """Alleen bestanden van minimaal de excerpt lengte (one-shots en korte samples niet)"""
+    return duration is None or duration >= excerpt_duration
+
+
+def compute_fingerprint(filename, duration=None, excerpt_duration=EXCERPT_DURATION):
+    """
+    Bereken fingerprint van een kort excerpt
+
+    Args:
+        filename: Pad naar audio bestand
+        duration: Duur van het bestand in seconden (voor de excerpt positie, optioneel)
+        excerpt_duration: Lengte van het excerpt in seconden
+
+    Returns:
+        fingerprint: Tuple (bits [frames, 24], voiced [frames]), of None als het bestand
+                     te kort is of te weinig signaal heeft om betrouwbaar te vergelijken
+    """
+    if not fingerprint_eligible(duration, excerpt_duration):
+        return None
+    y, sr = librosa.load(
+        filename,
+        sr=FINGERPRINT_SAMPLE_RATE,
+        offset=excerpt_offset(duration, excerpt_duration),
+        duration=excerpt_duration
+    )
+    if len(y) < excerpt_duration * sr * 0.95:
+        return None
+    bits, voiced = fingerprint_from_audio(y, sr)
+    if voiced.sum() < MIN_VOICED_FRAMES:
+        return None
+    return bits, voiced
+
+
+def fingerprint_from_audio(y, sr):
+    """
+    Bereken fingerprint bits uit een audio excerpt
+
+    Returns:
+        bits: Boolean array [frames, 24]
+        voiced: Boolean array [frames], True als het frame (en het vorige frame) signaal heeft
+    """
+    chroma = librosa.feature.chroma_stft(
+        y=y, sr=sr, n_fft=FINGERPRINT_N_FFT, hop_length=FINGERPRINT_HOP_LENGTH
+    )
+    if chroma.shape[1] < 2:
+        return np.zeros((0, FINGERPRINT_BITS), dtype=bool), np.zeros(0, dtype=bool)
+
+    # Toonklasse contrast: sterker dan de volgende toonklasse?
+    pitch_bits = chroma > np.roll(chroma, -1, axis=0)
+    # Temporeel contrast: sterker dan in het vorige frame?
+    time_bits = chroma[:, 1:] > chroma[:, :-1]
+
+    # Signaal per frame; de temporele bits hangen ook van het vorige frame af
+    rms = librosa.feature.rms(y=y, frame_length=FINGERPRINT_N_FFT, hop_length=FINGERPRINT_HOP_LENGTH)[0]
+    loud = 20 * np.log10(np.maximum(rms[:chroma.shape[1]], 1e-10)) >= VOICED_RMS_DB
+    voiced = loud[1:] & loud[:-1]
+
+    return np.concatenate([pitch_bits[:, 1:], time_bits], axis=0).T, voiced
+
+
+def encode_fingerprint(bits):
+    """Serialiseer fingerprint bits (of het voiced masker) naar een compacte base64 string"""
+    return base64.b64encode(np.packbits(bits, axis=None).tobytes()).decode('ascii')
+
+
+def decode_fingerprint(encoded, frames, width=FINGERPRINT_BITS):
+    """Deserialiseer een fingerprint van encode_fingerprint() (width=1 voor het voiced masker)"""
+    packed = np.frombuffer(base64.b64decode(encoded), dtype=np.uint8)
+    bits = np.unpackbits(packed)[:frames * width]
+    return bits.astype(bool).reshape(frames, width) if width > 1 else bits.astype(bool)
+
+
+def fingerprint_similarity(a, b, max_shift=MAX_SHIFT):
+    """
+    Vergelijk twee fingerprints (fractie gelijke bits, beste verschuiving)
+
+    Alleen frames met signaal in beide fingerprints tellen mee; met minder dan
+    MIN_VOICED_FRAMES van zulke frames is de overeenkomst 0.
+
+    Args:
+        a, b: Tuples (bits, voiced) van compute_fingerprint()
+
+    Returns:
+        similarity: 0-1 (1 = identiek)
+    """
+    (a_bits, a_voiced), (b_bits, b_voiced) = a, b
+    best = 0.0
+    for shift in range(-max_shift, max_shift + 1):
+        a_start, b_start = max(shift, 0), max(-shift, 0)
+        frames = min(len(a_bits) - a_start, len(b_bits) - b_start)
+        if frames <= 0:
+            continue
+        voiced = a_voiced[a_start:a_start + frames] & b_voiced[b_start:b_start + frames]
+        # Te weinig gemeenschappelijk signaal is geen betrouwbare vergelijking
+        if voiced.sum() < MIN_VOICED_FRAMES:
+            continue
+        equal = a_bits[a_start:a_start + frames][voiced] == b_bits[b_start:b_start + frames][voiced]
+        best = max(best, float(np.mean(equal)))
+    return best
+
+
+def _read_entries(f, entries):
+    """
+    Lees complete regels vanaf de huidige positie en voeg geldige entries toe
+
+    Returns:
+        Aantal gelezen bytes (een half geschreven laatste regel telt niet mee)
+    """
+    data = f.read()
+    end = data.rfind(b'\n') + 1
+    for line in data[:end].splitlines():
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            print("Waarschuwing: Ongeldige regel in fingerprint index wordt overgeslagen")
+            continue
+        # Entries van een ander fingerprint formaat (of een oude JSON index) zijn niet vergelijkbaar
+        if isinstance(entry, dict) and entry.get('version') == FINGERPRINT_VERSION:
+            entries.append(entry)
+    return end
+
+
+def load_fingerprint_index(index_path):
+    """
+    Laad fingerprint index (leeg als het bestand niet bestaat)
+
+    Returns:
+        index: Dictionary met 'version' en 'entries'
+    """
+    index = {'version': FINGERPRINT_VERSION, 'entries': []}
+    try:
+        with open(index_path, 'rb') as f:
+            _read_entries(f, index['entries'])
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Waarschuwing: Kon fingerprint index niet lezen: {e}")
+    return index
+
+
+# Per proces: geladen index per pad (met bestand identiteit en gelezen bytes) en gedecodeerde entries
+_index_cache = {}
+_decoded_cache = {}
+MAX_DECODED_CACHE = 50000
+
+
+def load_fingerprint_index_cached(index_path):
+    """
+    Zoals load_fingerprint_index, maar leest bij een volgende aanroep alleen de regels die
+    sindsdien toegevoegd zijn (de API zoekt bij elke request; alleen-lezen gebruik, niet aanpassen)
+    """
+    try:
+        f = open(index_path, 'rb')
+    except FileNotFoundError:
+        _index_cache.pop(index_path, None)
+        return {'version': FINGERPRINT_VERSION, 'entries': []}
+    except OSError as e:
+        print(f"Waarschuwing: Kon fingerprint index niet lezen: {e}")
+        return {'version': FINGERPRINT_VERSION, 'entries': []}
+
+    with f:
+        stat = os.fstat(f.fileno())
+        identity = (stat.st_dev, stat.st_ino)
+        cached = _index_cache.get(index_path)
+        # Vervangen of ingekort bestand: opnieuw vanaf het begin
+        if cached is None or cached[0] != identity or stat.st_size < cached[1]:
+            cached = (identity, 0, {'version': FINGERPRINT_VERSION, 'entries': []})
+        _, offset, index = cached
+        if stat.st_size > offset:
+            f.seek(offset)
+            offset += _read_entries(f, index['entries'])
+        _index_cache[index_path] = (identity, offset, index)
+    return index
+
+
+def _decode_entry(entry):
+    """Gedecodeerde (bits, voiced) van een index entry, gecached op de encoded string"""
+    cache_key = entry['fingerprint']
+    decoded = _decoded_cache.get(cache_key)
+    if decoded is None:
+        if len(_decoded_cache) >= MAX_DECODED_CACHE:
+            _decoded_cache.clear()
+        decoded = (decode_fingerprint(entry['fingerprint'], entry['frames']),
+                   decode_fingerprint(entry['voiced'], entry['frames'], width=1))
+        _decoded_cache[cache_key] = decoded
+    return decoded
+
+
+@contextmanager
+def _append_lock(f):
+    """Exclusieve lock tijdens één append, zodat regels van verschillende processen niet door elkaar lopen"""
+    if not FCNTL_AVAILABLE:
+        yield
+        return
+    fcntl.flock(f, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def find_match(index, fingerprint, duration=None, threshold=MATCH_THRESHOLD):
+    """
+    Zoek de beste match voor een fingerprint in de index
+
+    Args:
+        index: Index van load_fingerprint_index()
+        fingerprint: Fingerprint van compute_fingerprint()
+        duration: Duur van het bestand (kandidaten met afwijkende duur worden overgeslagen)
+        threshold: Minimale overeenkomst voor een match
+
+    Returns:
+        entry: Index entry van de beste match (None als geen confident match)
+        similarity: Overeenkomst van de beste kandidaat (0-1)
+    """
+    best_entry, best_similarity = None, 0.0
+    if fingerprint is None:
+        return None, 0.0
+
+    for entry in index['entries']:
+        # Alleen volledige analyses met een tempo zijn herbruikbaar
+        if entry.get('analysis_method', 'full') != 'full' or entry['analysis'].get('bpm') is None:
+            continue
+        if duration is not None and entry.get('duration') is not None:
+            if abs(entry['duration'] - duration) > DURATION_TOLERANCE:
+                continue
+        similarity = fingerprint_similarity(fingerprint, _decode_entry(entry))
+        if similarity > best_similarity:
+            best_entry, best_similarity = entry, similarity
+
+    if best_similarity < threshold:
+        return None, best_similarity
+    return best_entry, best_similarity
+
+
+def record_fingerprint(index_path, fingerprint, duration, analysis, analysis_method='full'):
+    """
+    Voeg fingerprint + herbruikbare analyse velden als één regel toe aan de index op schijf
+
+    Args:
+        index_path: Pad naar index bestand
+        fingerprint: Fingerprint van compute_fingerprint()
+        duration: Duur van het bestand in seconden
+        analysis: Resultaat van analyze_audio()
+        analysis_method: Welke schatters de analyse maakten ('full' = detect_bpm_accurate en
+                         detect_key_accurate); find_match hergebruikt alleen 'full'
+    """
+    # Zonder tempo valt er niets te hergebruiken
+    if fingerprint is None or analysis.get('bpm') is None:
+        return
+
+    bits, voiced = fingerprint
+    entry = {
+        'version': FINGERPRINT_VERSION,
+        'fingerprint': encode_fingerprint(bits),
+        'voiced': encode_fingerprint(voiced),
+        'frames': int(len(bits)),
+        'duration': duration,
+        'filename': analysis.get('filename'),
+        'analysis_method': analysis_method,
+        'analysis': {field: analysis[field] for field in REUSABLE_FIELDS if field in analysis},
+    }
+
+    line = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+    # Ongebufferd: de regel moet geschreven zijn voordat de lock vrijkomt
+    with open(index_path, 'ab', buffering=0) as f:
+        with _append_lock(f):
+            f.write(line)
@@ -0,0 +1,319 @@
+"""
+Mix analyse - deel een lange DJ mix op in segmenten met BPM, key en energie per segment
+
+De opname wordt in blokken gestreamd (geheugen voor audio blijft constant, ongeacht de
+lengte van de mix). Per venster van 10 seconden (hop 5 seconden) worden tempo, chroma en
+energie berekend; per venster blijven alleen ~16 getallen bewaard. Overgangen worden
+gevonden met PELT (Pruned Exact Linear Time) change-point detectie over die features.
+
+Gebruik:
+    from python.mix_analysis import analyze_mix
+    result = analyze_mix('set_2024.mp3')
+    for segment in result['segments']:
+        print(segment['start_formatted'], segment['bpm'], segment['key'])
+"""
+
+import shutil
+import subprocess
+import numpy as np
+try:
+    import soundfile as sf
+    SOUNDFILE_AVAILABLE = True
+except ImportError:
+    SOUNDFILE_AVAILABLE = False
+try:
+    import soxr
+    SOXR_AVAILABLE = True
+except ImportError:
+    SOXR_AVAILABLE = False
+
+from .batch import batch_descriptors, estimate_key
+from .music_analyzer import KEYS, read_metadata
+
+
+MIX_SAMPLE_RATE = 22050
+# Venster voor features en de stap tussen vensters (bepaalt de resolutie van de grenzen)
+WINDOW_SECONDS = 10.0
+HOP_SECONDS = 5.0
+# Aantal vensters per gevectoriseerde aanroep (begrenst het geheugen)
+WINDOWS_PER_BATCH = 16
+
+# Kortste segment; DJ overgangen duren meestal 16-64 maten
+MIN_SEGMENT_SECONDS = 60.0
+# Penalty per extra segment, als factor van de BIC penalty (d * log(n)); hoger = minder segmenten
+DEFAULT_PENALTY = 3.0
+
+
+def iter_audio_blocks(filename, sr=MIX_SAMPLE_RATE, block_seconds=HOP_SECONDS):
+    """
+    Stream een audio bestand als mono blokken van block_seconds
+
+    Gebruikt soundfile (wav/flac/ogg/mp3 bij libsndfile >= 1.1) en valt terug op een
+    ffmpeg pipe voor andere formaten. Het volledige bestand wordt nooit in het geheugen geladen.
+    Resamplen gaat met een soxr stream, zodat er geen randeffecten op de blokgrenzen ontstaan.
+
+    Yields:
+        block: Mono float32 audio op sample rate sr
+    """
+    sound_file = None
+    if SOUNDFILE_AVAILABLE:
+        try:
+            sound_file = sf.SoundFile(filename)
+        except Exception:
+            sound_file = None
+
+    if sound_file is not None:
+        with sound_file:
+            native_sr = sound_file.samplerate
+            blocksize = int(block_seconds * native_sr)
+            resampler = None
+            if native_sr != sr:
+                if not SOXR_AVAILABLE:
+                    raise RuntimeError(f"Kan {filename} niet streamen: resamplen vereist soxr")
+                resampler = soxr.ResampleStream(native_sr, sr, 1, dtype='float32')
+            for data in sound_file.blocks(blocksize=blocksize, dtype='float32', always_2d=True):
+                block = data.mean(axis=1)
+                if resampler is not None:
+                    block = resampler.resample_chunk(block)
+                yield block
+            if resampler is not None:
+                # Resterende samples uit het filter van de resampler
+                yield resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+        return
+
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise RuntimeError(f"Kan {filename} niet streamen: formaat niet ondersteund door soundfile en ffmpeg niet gevonden")
+
+    process = subprocess.Popen(
+        [ffmpeg, '-v', 'error', '-i', str(filename), '-f', 'f32le', '-ac', '1', '-ar', str(sr), 'pipe:1'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    block_bytes = int(block_seconds * sr) * 4
+    try:
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            yield np.frombuffer(data[:len(data) - len(data) % 4], dtype=np.float32)
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+
+
+def iter_windows(blocks, sr=MIX_SAMPLE_RATE, window_seconds=WINDOW_SECONDS, hop_seconds=HOP_SECONDS):
+    """
+    Zet een stroom blokken om in overlappende vensters (window_seconds lang, hop_seconds stap)
+
+    Yields:
+        window: Mono audio array
+    """
+    window_size = int(window_seconds * sr)
+    hop_size = int(hop_seconds * sr)
+    buffer = np.zeros(0, dtype=np.float32)
+
+    for block in blocks:
+        buffer = np.concatenate([buffer, block])
+        while len(buffer) >= window_size:
+            yield buffer[:window_size]
+            buffer = buffer[hop_size:]
+
+    # Laatste (kortere) venster, als er na het vorige venster nog nieuwe audio is
+    if len(buffer) > window_size - hop_size:
+        yield buffer
+
+
+def window_features(descriptors):
+    """
+    Feature vectoren voor change-point detectie uit batch_descriptors()
+
+    - chroma (12): genormaliseerd profiel, verandert bij een nieuwe toonsoort
+    - tempo (2): positie binnen het octaaf op de cirkel (cos/sin van 2*pi*log2(bpm)),
+      zodat half/dubbel tempo schattingen niet als overgang tellen
+    - energie (1): gemiddelde RMS in dB
+
+    Returns:
+        features: Array [n, 15]
+    """
+    chroma = descriptors["chroma_mean"]
+    chroma = chroma / np.maximum(chroma.sum(axis=1, keepdims=True), 1e-10)
+
+    bpm = np.maximum(descriptors["bpm"], 1.0)
+    angle = 2 * np.pi * np.log2(bpm)
+    confidence = descriptors["bpm_confidence"][:, None]
+    tempo = np.stack([np.cos(angle), np.sin(angle)], axis=1) * confidence
+
+    energy_db = 20 * np.log10(np.maximum(descriptors["energy"], 1e-10))[:, None]
+
+    return np.concatenate([chroma, tempo, energy_db], axis=1)
+
+
+def pelt(features, penalty, min_size=1):
+    """
+    PELT change-point detectie (verwacht lineaire tijd) met een Gaussisch mean-shift kostmodel
+
+    Args:
+        features: Array [n, d]
+        penalty: Kosten per extra segment
+        min_size: Minimaal aantal rijen per segment
+
+    Returns:
+        boundaries: Gesorteerde lijst van segment starts (exclusief 0)
+    """
+    n = len(features)
+    if n < 2 * min_size:
+        return []
+
+    cumsum = np.vstack([np.zeros(features.shape[1]), np.cumsum(features, axis=0)])
+    cumsum_sq = np.concatenate([[0.0], np.cumsum(np.sum(features ** 2, axis=1))])
+
+    def segment_cost(starts, end):
+        # Som van kwadratische afwijkingen t.o.v. het segment gemiddelde, voor alle starts tegelijk
+        sums = cumsum[end] - cumsum[starts]
+        return (cumsum_sq[end] - cumsum_sq[starts]) - np.sum(sums ** 2, axis=1) / (end - starts)
+
+    best_cost = np.full(n + 1, np.inf)
+    best_cost[0] = -penalty
+    previous = np.zeros(n + 1, dtype=int)
+    candidates = np.array([0])
+
+    for end in range(min_size, n + 1):
+        admissible = candidates[end - candidates >= min_size]
+        if len(admissible):
+            costs = best_cost[admissible] + segment_cost(admissible, end) + penalty
+            best = np.argmin(costs)
+            best_cost[end] = costs[best]
+            previous[end] = admissible[best]
+
+            # Pruning: starts die nu al slechter zijn komen nooit meer terug
+            keep = (end - candidates < min_size)
+            keep[end - candidates >= min_size] = costs - penalty <= best_cost[end]
+            candidates = candidates[keep]
+
+        if end <= n - min_size:
+            candidates = np.append(candidates, end)
+
+    boundaries = []
+    position = n
+    while position > 0:
+        position = previous[position]
+        if position > 0:
+            boundaries.append(int(position))
+    return sorted(boundaries)
+
+
+def _format_time(seconds):
+    """Formatteer seconden als m:ss of h:mm:ss"""
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
+
+
+def _segment_tempo(bpm, confidence):
+    """
+    Tempo van een segment: gewogen mediaan van de vensters, na vouwen naar het
+    octaaf van het meest betrouwbare venster (half/dubbel tempo fouten corrigeren)
+    """
+    valid = bpm > 0
+    if not np.any(valid):
+        return None, 0.0
+    bpm, confidence = bpm[valid], confidence[valid]
+
+    reference = bpm[np.argmax(confidence)]
+    folded = bpm * 2.0 ** np.round(np.log2(reference / bpm))
+
+    order = np.argsort(folded)
+    weights = np.cumsum(confidence[order])
+    median = folded[order][np.searchsorted(weights, weights[-1] / 2)]
+    return int(round(median)), float(np.mean(confidence))
+
+
+def analyze_mix(filename, sample_rate=MIX_SAMPLE_RATE, min_segment_seconds=MIN_SEGMENT_SECONDS,
+                penalty=DEFAULT_PENALTY):
+    """
+    Analyseer een volledige DJ mix en splits deze in segmenten (tracklist)
+
+    Args:
+        filename: Pad naar audio bestand van de mix
+        sample_rate: Sample rate voor analyse (default: 22050)
+        min_segment_seconds: Minimale lengte van een segment in seconden (default: 60)
+        penalty: Gevoeligheid van de segmentatie; hoger = minder segmenten (default: 3.0)
+
+    Returns:
+        Dictionary met:
+            - song_name, duration, duration_formatted, bitrate: Zoals analyze_audio
+            - segment_count: Aantal segmenten
+            - segments: Lijst met per segment: index, start, end, start_formatted,
+              end_formatted, bpm, bpm_confidence, key, key_confidence, energy, energy_db
+    """
+    metadata = read_metadata(filename)
+
+    # Stream vensters door batch_descriptors; per venster blijven alleen de descriptors over
+    collected = {"bpm": [], "bpm_confidence": [], "chroma_mean": [], "energy": []}
+    total_samples = 0
+    pending = []
+
+    def flush():
+        descriptors = batch_descriptors(pending, sr=sample_rate)
+        for name in collected:
+            collected[name].append(descriptors[name])
+        pending.clear()
+
+    hop_size = int(HOP_SECONDS * sample_rate)
+    for window_index, window in enumerate(iter_windows(iter_audio_blocks(filename, sample_rate), sample_rate)):
+        total_samples = window_index * hop_size + len(window)
+        pending.append(window)
+        if len(pending) >= WINDOWS_PER_BATCH:
+            flush()
+    if pending:
+        flush()
+
+    if not collected["bpm"]:
+        raise ValueError(f"Geen audio gevonden in {filename}")
+
+    descriptors = {name: np.concatenate(values) for name, values in collected.items()}
+    n_windows = len(descriptors["bpm"])
+    analyzed_duration = total_samples / sample_rate
+    duration = metadata["duration"] or analyzed_duration
+
+    # Change-point detectie over gestandaardiseerde features
+    features = window_features(descriptors)
+    std = features.std(axis=0)
+    features = (features - features.mean(axis=0)) / np.where(std > 1e-10, std, 1.0)
+    min_size = max(1, int(round(min_segment_seconds / HOP_SECONDS)))
+    boundaries = pelt(features, penalty * features.shape[1] * np.log(max(n_windows, 2)), min_size)
+
+    segments = []
+    edges = [0] + boundaries + [n_windows]
+    for index, (start, end) in enumerate(zip(edges[:-1], edges[1:])):
+        bpm, bpm_confidence = _segment_tempo(descriptors["bpm"][start:end], descriptors["bpm_confidence"][start:end])
+        key_index, is_minor, key_confidence = estimate_key(descriptors["chroma_mean"][start:end].mean(axis=0))
+        energy = float(descriptors["energy"][start:end].mean())
+
+        start_seconds = start * HOP_SECONDS
+        end_seconds = analyzed_duration if end == n_windows else end * HOP_SECONDS
+        segments.append({
+            "index": index,
+            "start": round(start_seconds, 2),
+            "end": round(end_seconds, 2),
+            "start_formatted": _format_time(start_seconds),
+            "end_formatted": _format_time(end_seconds),
+            "bpm": bpm,
+            "bpm_confidence": round(bpm_confidence, 3),
+            "key": f"{KEYS[key_index[0]]} {'minor' if is_minor[0] else 'major'}",
+            "key_confidence": round(float(key_confidence[0]), 3),
+            "energy": round(energy, 4),
+            "energy_db": round(float(20 * np.log10(max(energy, 1e-10))), 2)
+        })
+
+    return {
+        "song_name": metadata["song_name"],
+        "duration": round(duration, 2),
+        "duration_formatted": _format_time(duration),
+        "bitrate": metadata["bitrate"],
+        "segment_count": len(segments),
+        "segments": segments
+    }
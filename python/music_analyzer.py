@@ -10,6 +10,7 @@ Gebruik:
 import librosa
 import numpy as np
 from pathlib import Path
+from .fingerprint import compute_fingerprint, find_match, load_fingerprint_index_cached, record_fingerprint
 try:
     from mutagen import File as MutagenFile
     MUTAGEN_AVAILABLE = True
@@ -120,12 +121,13 @@ def detect_key_accurate(y, sr):
     return key, mode, confidence
 
 
-def get_bitrate(filename):
+def get_bitrate(filename, audio_file=None):
     """
     Haal bitrate op uit audio bestand metadata
     
     Args:
         filename: Pad naar audio bestand
+        audio_file: Al geopend Mutagen bestand (optioneel, voorkomt opnieuw openen)
     
     Returns:
         bitrate: Bitrate in kbps (None als niet beschikbaar)
@@ -134,7 +136,8 @@ def get_bitrate(filename):
         return None
     
     try:
-        audio_file = MutagenFile(filename)
+        if audio_file is None:
+            audio_file = MutagenFile(filename)
         if audio_file is None:
             return None
         
@@ -158,19 +161,21 @@ def get_bitrate(filename):
     return None
 
 
-def get_file_duration(filename):
+def get_file_duration(filename, audio_file=None):
     """
     Haal originele duur van audio bestand op uit metadata
     
     Args:
         filename: Pad naar audio bestand
+        audio_file: Al geopend Mutagen bestand (optioneel, voorkomt opnieuw openen)
     
     Returns:
         duration_seconds: Duur in seconden (float), of None als niet beschikbaar
     """
     if MUTAGEN_AVAILABLE:
         try:
-            audio_file = MutagenFile(filename)
+            if audio_file is None:
+                audio_file = MutagenFile(filename)
             if audio_file is not None and hasattr(audio_file, 'info'):
                 # Duur is meestal beschikbaar in info.length
                 if hasattr(audio_file.info, 'length') and audio_file.info.length:
@@ -182,12 +187,13 @@ def get_file_duration(filename):
     return None
 
 
-def get_song_name(filename):
+def get_song_name(filename, audio_file=None):
     """
     Haal song naam op uit metadata of filename
     
     Args:
         filename: Pad naar audio bestand
+        audio_file: Al geopend Mutagen bestand (optioneel, voorkomt opnieuw openen)
     
     Returns:
         song_name: Naam van het nummer
@@ -195,7 +201,8 @@ def get_song_name(filename):
     # Probeer eerst metadata
     if MUTAGEN_AVAILABLE:
         try:
-            audio_file = MutagenFile(filename)
+            if audio_file is None:
+                audio_file = MutagenFile(filename)
             if audio_file is not None:
                 # Probeer verschillende metadata tags
                 for tag_key in ['TIT2', 'TITLE', '©nam', 'title']:
@@ -210,7 +217,34 @@ def get_song_name(filename):
     return Path(filename).stem
 
 
-def extract_waveform(y, sr, max_samples=5000):
+def read_metadata(filename):
+    """
+    Haal song naam, duur en bitrate op met één keer openen van het bestand
+    
+    Args:
+        filename: Pad naar audio bestand
+    
+    Returns:
+        Dictionary met: song_name, duration (None als onbekend), bitrate (None als onbekend)
+    """
+    audio_file = None
+    if MUTAGEN_AVAILABLE:
+        try:
+            audio_file = MutagenFile(filename)
+        except Exception as e:
+            print(f"Waarschuwing: Kon metadata niet lezen: {e}")
+    
+    if audio_file is None:
+        return {"song_name": Path(filename).stem, "duration": None, "bitrate": None}
+    
+    return {
+        "song_name": get_song_name(filename, audio_file),
+        "duration": get_file_duration(filename, audio_file),
+        "bitrate": get_bitrate(filename, audio_file)
+    }
+
+
+def extract_waveform(y, sr, max_samples=5000, as_array=False):
     """
     Extraheer waveform data voor opslag
     Downsampled voor efficiënte opslag (niet het originele bestand)
@@ -220,9 +254,11 @@ def extract_waveform(y, sr, max_samples=5000):
         sr: Sample rate
         max_samples: Maximum aantal samples voor waveform (default: 5000)
                     Voor visualisatie is dit meestal voldoende
+        as_array: Retourneer waveform als numpy array i.p.v. list (default: False)
+                  Handig als het resultaat door python.encoding wordt geëncodeerd
     
     Returns:
-        waveform: Downsampled waveform array (list voor JSON serialisatie)
+        waveform: Downsampled waveform array (list voor JSON serialisatie, of numpy array)
         waveform_samples: Aantal samples in waveform
         original_samples: Aantal samples in origineel
         sample_rate: Sample rate
@@ -237,50 +273,86 @@ def extract_waveform(y, sr, max_samples=5000):
     else:
         waveform = y.copy()
     
-    # Converteer naar list voor JSON serialisatie
-    waveform_list = waveform.tolist()
+    # Converteer naar list voor JSON serialisatie (tenzij de encoder de array zelf verwerkt)
+    waveform_out = waveform if as_array else waveform.tolist()
     
     return {
-        "waveform": waveform_list,
-        "waveform_samples": len(waveform_list),
+        "waveform": waveform_out,
+        "waveform_samples": len(waveform_out),
         "original_samples": int(original_samples),
         "sample_rate": int(sr),
         "downsampled": original_samples > max_samples
     }
 
 
-def analyze_audio(filename, sample_rate=44100, include_waveform=True, waveform_samples=5000, max_duration=None):
+def warmup(sample_rate=22050):
     """
-    Analyseer audio bestand en extraheer alle gewenste informatie
+    Draai de analyse eenmalig op een kort synthetisch signaal
+    
+    librosa compileert zijn numba kernels bij het eerste gebruik (enkele seconden).
+    Door dit in het parent proces te doen vóór het forken, delen alle workers de
+    gecompileerde kernels copy-on-write en is ook de eerste request snel.
     
     Args:
-        filename: Pad naar audio bestand (mp3, wav, m4a, flac, etc.)
-        sample_rate: Sample rate voor analyse (default: 44100)
-        include_waveform: Of waveform data moet worden opgenomen (default: True)
-        waveform_samples: Maximum aantal samples voor waveform (default: 5000)
-        max_duration: Maximum duur in seconden om te analyseren (None = volledig bestand)
-                     NOTE: Dit limiteert alleen de analyse, niet de opgeslagen duur
+        sample_rate: Sample rate van het testsignaal
+    """
+    t = np.arange(sample_rate * 4) / sample_rate
+    y = (0.3 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+    # Klikken op 120 BPM zodat beat tracking echte onsets heeft
+    y[(np.arange(len(y)) % (sample_rate // 2)) < 100] += 0.5
+    
+    detect_bpm_accurate(y, sample_rate)
+    detect_key_accurate(y, sample_rate)
+    extract_waveform(y, sample_rate)
+
+
+# Velden per groep in de vereenvoudigde output (analyze_audio_simple): veld -> naam in simple resultaat
+SIMPLE_FIELDS = {
+    "bpm": "bpm",
+    "bpm_confidence": "bpm_confidence",
+    "key_full": "key",
+    "key_confidence": "key_confidence",
+    "song_name": "song_name",
+    "duration": "duration",
+    "duration_formatted": "duration_formatted",
+    "bitrate": "bitrate",
+    "waveform": "waveform",
+    "fingerprint_match": "fingerprint_match"
+}
+
+
+def iter_analysis(filename, sample_rate=44100, include_waveform=True, waveform_samples=5000, max_duration=None,
+                  waveform_as_array=False, fingerprint_index=None, fingerprint_mode='reuse'):
+    """
+    Analyseer audio bestand en geef elke groep velden zodra die berekend is
     
-    Returns:
-        Dictionary met:
-            - bpm: BPM waarde (integer)
-            - bpm_confidence: Betrouwbaarheid BPM (0-1)
-            - key: Toonsoort (bijv. 'C', 'D#')
-            - mode: 'major' of 'minor'
-            - key_confidence: Betrouwbaarheid key (0-1)
-            - song_name: Naam van het nummer
-            - duration: Originele duur in seconden (float) - NIET de geanalyseerde duur
-            - duration_formatted: Originele duur geformatteerd (bijv. "3:45")
-            - bitrate: Bitrate in kbps (None als niet beschikbaar)
-            - waveform: Waveform data (downsampled, alleen als include_waveform=True)
-            - filename: Originele bestandsnaam
+    Volgorde: 'metadata' (milliseconden), 'fingerprint' (alleen bij een match),
+    'waveform' (direct na het laden), 'tempo' en 'key' (de zware features).
+    Zo kan een client de track al tonen voordat BPM en key bekend zijn.
+    
+    Args:
+        Zie analyze_audio
+    
+    Yields:
+        group: Naam van de groep ('metadata', 'fingerprint', 'waveform', 'tempo', 'key')
+        fields: Dictionary met de velden van die groep (zelfde namen als in analyze_audio)
     """
+    if fingerprint_mode not in ('reuse', 'seed'):
+        raise ValueError(f"Ongeldige fingerprint_mode: {fingerprint_mode}. Gebruik 'reuse' of 'seed'")
+    
+    result = {}
+    
+    def emit(group, fields):
+        result.update(fields)
+        return group, fields
+    
+    # Metadata met één keer openen van het bestand (song naam, bitrate, duur)
+    metadata = read_metadata(filename)
+    
     # Haal originele duur op uit metadata VOORDAT we audio laden
     # Dit is belangrijk omdat we misschien alleen een deel analyseren (max_duration)
     # maar we willen wel de volledige originele duur opslaan
-    
-    # Probeer eerst mutagen (kan snel zijn)
-    original_duration = get_file_duration(filename)
+    original_duration = metadata["duration"]
     
     # Als mutagen geen duur geeft OF als we max_duration gebruiken,
     # gebruik librosa.get_duration() die de volledige duur uit bestandsmetadata haalt
@@ -303,73 +375,169 @@ def analyze_audio(filename, sample_rate=44100, include_waveform=True, waveform_s
                 except Exception as e2:
                     print(f"Waarschuwing: Volledige load ook gefaald: {e2}")
     
-    # Laad audio (met optionele duration limit voor grote bestanden)
-    # Dit limiteert alleen wat we analyseren, niet wat we opslaan
-    if max_duration:
-        y, sr = librosa.load(filename, sr=sample_rate, duration=max_duration)
-        # Als we nog steeds geen originele duur hebben na alle pogingen, gebruik max_duration als laatste fallback
-        if original_duration is None:
-            print(f"Waarschuwing: Gebruik max_duration als fallback voor duur")
-            original_duration = max_duration
-    else:
-        y, sr = librosa.load(filename, sr=sample_rate)
-        # Als we geen max_duration hebben en ook geen metadata duur, gebruik geladen audio duur
-        if original_duration is None:
-            original_duration = len(y) / sr
-    
-    # BPM detectie
-    bpm, bpm_confidence = detect_bpm_accurate(y, sr)
-    
-    # Key detectie
-    key, mode, key_confidence = detect_key_accurate(y, sr)
-    
-    # Gebruik originele duur als beschikbaar, anders fallback naar geladen audio duur
+    def metadata_fields(duration_seconds):
+        minutes = int(duration_seconds // 60)
+        seconds = int(duration_seconds % 60)
+        return {
+            "song_name": metadata["song_name"],
+            "duration": round(duration_seconds, 2),
+            "duration_formatted": f"{minutes}:{seconds:02d}",  # Bijv. "3:45"
+            "bitrate": metadata["bitrate"],
+            "bitrate_kbps": metadata["bitrate"],  # Alias voor duidelijkheid
+            "filename": Path(filename).name,
+            "filepath": str(filename)
+        }
+    
+    # Metadata direct doorgeven als de duur al bekend is (anders na het laden van de audio)
     if original_duration is not None:
-        duration_seconds = original_duration
-    else:
-        # Fallback: gebruik duur van geladen audio
-        duration_seconds = len(y) / sr
-    
-    minutes = int(duration_seconds // 60)
-    seconds = int(duration_seconds % 60)
-    duration_formatted = f"{minutes}:{seconds:02d}"
+        yield emit("metadata", metadata_fields(original_duration))
     
-    # Song naam
-    song_name = get_song_name(filename)
-    
-    # Bitrate
-    bitrate = get_bitrate(filename)
+    # Fingerprint van een kort excerpt: herkent dezelfde opname in een andere encoding
+    fingerprint = None
+    match = None
+    if fingerprint_index:
+        try:
+            fingerprint = compute_fingerprint(filename, duration=original_duration)
+            match, similarity = find_match(load_fingerprint_index_cached(fingerprint_index), fingerprint,
+                                           original_duration)
+            if match:
+                print(f"Fingerprint match ({similarity:.3f}) met {match.get('filename')}, analyse wordt hergebruikt")
+        except Exception as e:
+            print(f"Waarschuwing: Fingerprint gefaald: {e}")
+    
+    if match is not None:
+        yield emit("fingerprint", {
+            "fingerprint_match": {
+                "similarity": round(similarity, 3),
+                "filename": match.get("filename"),
+                "analysis_method": match.get("analysis_method", "full")
+            }
+        })
+    
+    # Bij 'reuse' zonder waveform hoeft de audio helemaal niet geladen te worden
+    y, sr = None, sample_rate
+    if match is None or fingerprint_mode != 'reuse' or include_waveform:
+        # Laad audio (met optionele duration limit voor grote bestanden)
+        # Dit limiteert alleen wat we analyseren, niet wat we opslaan
+        if max_duration:
+            y, sr = librosa.load(filename, sr=sample_rate, duration=max_duration)
+            # Als we nog steeds geen originele duur hebben na alle pogingen, gebruik max_duration als laatste fallback
+            if original_duration is None:
+                print(f"Waarschuwing: Gebruik max_duration als fallback voor duur")
+                original_duration = max_duration
+                yield emit("metadata", metadata_fields(original_duration))
+        else:
+            y, sr = librosa.load(filename, sr=sample_rate)
+            # Als we geen max_duration hebben en ook geen metadata duur, gebruik geladen audio duur
+            if original_duration is None:
+                original_duration = len(y) / sr
+                yield emit("metadata", metadata_fields(original_duration))
+    elif original_duration is None:
+        original_duration = match.get('duration')
+        yield emit("metadata", metadata_fields(original_duration))
     
-    # Waveform extractie
-    waveform_data = None
+    # Waveform extractie (goedkoop, dus vóór de zware features)
     if include_waveform:
-        waveform_data = extract_waveform(y, sr, max_samples=waveform_samples)
-    
-    # Resultaat
-    result = {
-        "bpm": bpm,
-        "bpm_confidence": round(bpm_confidence, 3),
+        yield emit("waveform", {
+            "waveform": extract_waveform(y, sr, max_samples=waveform_samples, as_array=waveform_as_array)
+        })
+    
+    if match is None:
+        # BPM detectie
+        bpm, bpm_confidence = detect_bpm_accurate(y, sr)
+        yield emit("tempo", {"bpm": bpm, "bpm_confidence": round(bpm_confidence, 3)})
+        
+        # Key detectie
+        key, mode, key_confidence = detect_key_accurate(y, sr)
+    else:
+        stored = match['analysis']
+        bpm, bpm_confidence = stored['bpm'], stored['bpm_confidence']
+        if fingerprint_mode == 'seed':
+            # Eén snelle tempo schatting met de opgeslagen BPM als prior
+            onset_env = librosa.onset.onset_strength(y=y, sr=sr)
+            tempo = librosa.feature.tempo(onset_envelope=onset_env, sr=sr, start_bpm=stored['bpm'])
+            bpm = round(float(tempo[0]))
+        yield emit("tempo", {"bpm": bpm, "bpm_confidence": round(bpm_confidence, 3)})
+        key, mode, key_confidence = stored['key'], stored['mode'], stored['key_confidence']
+    
+    yield emit("key", {
         "key": key,
         "mode": mode,
         "key_full": f"{key} {mode}",  # Bijv. "C major" of "A minor"
-        "key_confidence": round(key_confidence, 3),
-        "song_name": song_name,
-        "duration": round(duration_seconds, 2),
-        "duration_formatted": duration_formatted,
-        "bitrate": bitrate,
-        "bitrate_kbps": bitrate,  # Alias voor duidelijkheid
-        "filename": Path(filename).name,
-        "filepath": str(filename)
-    }
+        "key_confidence": round(key_confidence, 3)
+    })
+    
+    if match is None and fingerprint is not None:
+        # Nieuwe opname: bewaar fingerprint zodat andere encodings deze analyse kunnen hergebruiken
+        try:
+            record_fingerprint(fingerprint_index, fingerprint, result["duration"], result)
+        except Exception as e:
+            print(f"Waarschuwing: Kon fingerprint niet opslaan: {e}")
+
+
+def iter_analysis_simple(filename, sample_rate=44100, include_waveform=False, waveform_samples=5000, max_duration=None,
+                         waveform_as_array=False, fingerprint_index=None, fingerprint_mode='reuse'):
+    """
+    Zoals iter_analysis, maar met alleen de velden van analyze_audio_simple per groep
+    
+    Yields:
+        group: Naam van de groep
+        fields: Dictionary met de vereenvoudigde velden van die groep
+    """
+    for group, fields in iter_analysis(filename, sample_rate, include_waveform=include_waveform,
+                                       waveform_samples=waveform_samples, max_duration=max_duration,
+                                       waveform_as_array=waveform_as_array, fingerprint_index=fingerprint_index,
+                                       fingerprint_mode=fingerprint_mode):
+        yield group, {SIMPLE_FIELDS[name]: value for name, value in fields.items() if name in SIMPLE_FIELDS}
+
+
+def analyze_audio(filename, sample_rate=44100, include_waveform=True, waveform_samples=5000, max_duration=None,
+                  waveform_as_array=False, fingerprint_index=None, fingerprint_mode='reuse'):
+    """
+    Analyseer audio bestand en extraheer alle gewenste informatie
     
-    # Voeg waveform toe als gevraagd
-    if waveform_data:
-        result["waveform"] = waveform_data
+    Args:
+        filename: Pad naar audio bestand (mp3, wav, m4a, flac, etc.)
+        sample_rate: Sample rate voor analyse (default: 44100)
+        include_waveform: Of waveform data moet worden opgenomen (default: True)
+        waveform_samples: Maximum aantal samples voor waveform (default: 5000)
+        max_duration: Maximum duur in seconden om te analyseren (None = volledig bestand)
+                     NOTE: Dit limiteert alleen de analyse, niet de opgeslagen duur
+        waveform_as_array: Waveform samples als numpy array i.p.v. list (default: False)
+        fingerprint_index: Pad naar fingerprint index (None = geen deduplicatie)
+                          Bij een confident match met een eerder geanalyseerde encoding van
+                          dezelfde opname wordt die analyse hergebruikt
+        fingerprint_mode: Wat te doen bij een match:
+                          'reuse' - BPM/key overnemen, audio alleen laden voor de waveform
+                          'seed'  - key overnemen, BPM snel herberekenen met opgeslagen BPM als prior
+    
+    Returns:
+        Dictionary met:
+            - bpm: BPM waarde (integer)
+            - bpm_confidence: Betrouwbaarheid BPM (0-1)
+            - key: Toonsoort (bijv. 'C', 'D#')
+            - mode: 'major' of 'minor'
+            - key_confidence: Betrouwbaarheid key (0-1)
+            - song_name: Naam van het nummer
+            - duration: Originele duur in seconden (float) - NIET de geanalyseerde duur
+            - duration_formatted: Originele duur geformatteerd (bijv. "3:45")
+            - bitrate: Bitrate in kbps (None als niet beschikbaar)
+            - waveform: Waveform data (downsampled, alleen als include_waveform=True)
+            - filename: Originele bestandsnaam
+            - fingerprint_match: Similarity en bronbestand (alleen bij een fingerprint match)
+    """
+    result = {}
+    for _, fields in iter_analysis(filename, sample_rate, include_waveform=include_waveform,
+                                   waveform_samples=waveform_samples, max_duration=max_duration,
+                                   waveform_as_array=waveform_as_array, fingerprint_index=fingerprint_index,
+                                   fingerprint_mode=fingerprint_mode):
+        result.update(fields)
     
     return result
 
 
-def analyze_audio_simple(filename, sample_rate=44100, include_waveform=False, waveform_samples=5000, max_duration=None):
+def analyze_audio_simple(filename, sample_rate=44100, include_waveform=False, waveform_samples=5000, max_duration=None,
+                         waveform_as_array=False, fingerprint_index=None, fingerprint_mode='reuse'):
     """
     Vereenvoudigde versie - retourneert alleen de essentiële velden
     
@@ -379,27 +547,27 @@ def analyze_audio_simple(filename, sample_rate=44100, include_waveform=False, wa
         include_waveform: Of waveform data moet worden opgenomen (default: False)
         waveform_samples: Maximum aantal samples voor waveform (default: 5000)
         max_duration: Maximum duur in seconden om te analyseren (None = volledig bestand)
+        waveform_as_array: Waveform samples als numpy array i.p.v. list (default: False)
+        fingerprint_index: Pad naar fingerprint index (zie analyze_audio)
+        fingerprint_mode: 'reuse' of 'seed' (zie analyze_audio)
     
     Returns:
-        Dictionary met: bpm, key, song_name, duration, bitrate, (optioneel: waveform)
+        Dictionary met: bpm, key, song_name, duration, bitrate, (optioneel: waveform, fingerprint_match)
     """
-    result = analyze_audio(filename, sample_rate, include_waveform=include_waveform, waveform_samples=waveform_samples, max_duration=max_duration)
-    
-    simple_result = {
-        "bpm": result["bpm"],
-        "bpm_confidence": result.get("bpm_confidence"),
-        "key": result["key_full"],
-        "key_confidence": result.get("key_confidence"),
-        "song_name": result["song_name"],
-        "duration": result["duration"],
-        "duration_formatted": result["duration_formatted"],
-        "bitrate": result["bitrate"]
-    }
-    
-    # Voeg waveform toe als gevraagd
-    if include_waveform and "waveform" in result:
-        simple_result["waveform"] = result["waveform"]
+    simple_result = {}
+    for _, fields in iter_analysis_simple(filename, sample_rate, include_waveform=include_waveform,
+                                          waveform_samples=waveform_samples, max_duration=max_duration,
+                                          waveform_as_array=waveform_as_array, fingerprint_index=fingerprint_index,
+                                          fingerprint_mode=fingerprint_mode):
+        simple_result.update(fields)
     
     return simple_result
 
 
+
+
+if __name__ == "__main__":
+    # Oude command line (python -m python.music_analyzer scan <dir>); nu python -m python scan <dir>
+    import sys
+    from python.scanner import main
+    sys.exit(main())
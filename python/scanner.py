@@ -0,0 +1,381 @@
+"""
+Library scanner - analyseer een complete muziekmap vanaf de command line
+Slaat bestanden over die sinds de vorige run niet veranderd zijn (size/mtime/hash in een
+lokaal manifest), analyseert nieuwe bestanden parallel over alle cores en schrijft
+resultaten naar JSONL of SQLite. Een onderbroken scan kan hervat worden.
+
+Gebruik:
+    python -m python scan ~/Music
+    python -m python scan ~/Music --output library.sqlite --workers 4
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import signal
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .music_analyzer import analyze_audio_simple
+
+
+AUDIO_EXTENSIONS = {'.mp3', '.wav', '.flac', '.m4a', '.aac', '.ogg', '.opus', '.aif', '.aiff', '.wma'}
+MANIFEST_VERSION = 1
+
+# Manifest niet na elk bestand wegschrijven bij grote libraries, wel minstens zo vaak
+MANIFEST_SAVE_INTERVAL = 2.0
+
+
+def iter_audio_files(root):
+    """
+    Loop recursief door een map en geef alle audio bestanden (gesorteerd)
+
+    Args:
+        root: Pad naar muziekmap
+
+    Yields:
+        path: Path van elk audio bestand
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        # Verborgen mappen (bijv. .git, .Trash) overslaan
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for name in sorted(filenames):
+            if not name.startswith('.') and Path(name).suffix.lower() in AUDIO_EXTENSIONS:
+                yield Path(dirpath) / name
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """
+    Bereken content hash van een bestand (BLAKE2b, 128 bits)
+
+    Args:
+        path: Pad naar bestand
+        chunk_size: Grootte van leesblokken in bytes
+
+    Returns:
+        hash: Hex string
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_path):
+    """
+    Laad manifest van een vorige scan (leeg manifest als het niet bestaat of corrupt is)
+
+    Returns:
+        manifest: Dictionary met 'version' en 'files' (relatief pad -> entry)
+    """
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION and isinstance(manifest.get('files'), dict):
+            return manifest
+        print(f"Waarschuwing: Onbekend manifest formaat, begin opnieuw: {manifest_path}")
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"Waarschuwing: Kon manifest niet lezen, begin opnieuw: {e}")
+    return {'version': MANIFEST_VERSION, 'files': {}}
+
+
+def save_manifest(manifest, manifest_path):
+    """
+    Schrijf manifest atomisch weg (tijdelijk bestand + rename), zodat een onderbreking
+    nooit een half geschreven manifest achterlaat
+    """
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+
+def plan_scan(root, manifest, retry_errors=False):
+    """
+    Bepaal welke bestanden (opnieuw) geanalyseerd moeten worden
+
+    Een bestand wordt overgeslagen als size en mtime gelijk zijn aan het manifest.
+    Zijn die veranderd maar is de hash gelijk (bijv. alleen gekopieerd of aangeraakt),
+    dan wordt alleen het manifest bijgewerkt.
+
+    Args:
+        root: Pad naar muziekmap
+        manifest: Manifest van load_manifest()
+        retry_errors: Bestanden die vorige keer faalden opnieuw proberen
+
+    Returns:
+        todo: Lijst van (relatief pad, size, mtime)
+        skipped: Aantal ongewijzigde bestanden
+    """
+    files = manifest['files']
+    todo = []
+    skipped = 0
+
+    for path in iter_audio_files(root):
+        rel_path = path.relative_to(root).as_posix()
+        try:
+            stat = path.stat()
+        except OSError as e:
+            print(f"Waarschuwing: Kan {rel_path} niet lezen: {e}")
+            continue
+
+        entry = files.get(rel_path)
+        if entry is None or (entry.get('status') == 'error' and retry_errors):
+            todo.append((rel_path, stat.st_size, stat.st_mtime))
+            continue
+
+        if entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime:
+            skipped += 1
+            continue
+
+        # Size/mtime veranderd: alleen opnieuw analyseren als de inhoud echt anders is
+        if entry.get('status') == 'done' and entry.get('hash') == file_hash(path):
+            entry['size'] = stat.st_size
+            entry['mtime'] = stat.st_mtime
+            skipped += 1
+        else:
+            todo.append((rel_path, stat.st_size, stat.st_mtime))
+
+    return todo, skipped
+
+
+def _init_worker():
+    """Workers negeren Ctrl+C; het hoofdproces regelt het netjes stoppen"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _analyze_file(root, rel_path, size, mtime, options):
+    """
+    Analyseer één bestand in een worker proces
+
+    Returns:
+        record: Dictionary met pad, size, mtime, hash, duur en resultaat of fout
+    """
+    path = Path(root) / rel_path
+    start = time.time()
+    record = {'path': rel_path, 'size': size, 'mtime': mtime}
+
+    try:
+        record['hash'] = file_hash(path)
+        record['analysis'] = analyze_audio_simple(str(path), **options)
+    except Exception as e:
+        record['error'] = str(e)
+
+    record['elapsed'] = round(time.time() - start, 2)
+    return record
+
+
+class _JsonlOutput:
+    """Append-only JSONL output (bij een heranalyse wint de laatste regel per pad)"""
+
+    def __init__(self, path):
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, record, analyzed_at):
+        line = {'path': record['path'], 'hash': record['hash'], 'analyzed_at': analyzed_at, **record['analysis']}
+        self.file.write(json.dumps(line, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class _SqliteOutput:
+    """SQLite output met één rij per pad (heranalyse overschrijft)"""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS analyses (
+                path TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                analyzed_at TEXT NOT NULL,
+                bpm INTEGER,
+                key TEXT,
+                duration REAL,
+                result TEXT NOT NULL
+            )
+            """
+        )
+        self.connection.commit()
+
+    def write(self, record, analyzed_at):
+        analysis = record['analysis']
+        self.connection.execute(
+            "INSERT OR REPLACE INTO analyses (path, hash, analyzed_at, bpm, key, duration, result) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                record['path'],
+                record['hash'],
+                analyzed_at,
+                analysis.get('bpm'),
+                analysis.get('key'),
+                analysis.get('duration'),
+                json.dumps(analysis, ensure_ascii=False),
+            ),
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def open_output(path, output_format=None):
+    """
+    Open output bestand voor scan resultaten
+
+    Args:
+        path: Pad naar output bestand
+        output_format: 'jsonl' of 'sqlite' (None = afleiden uit extensie)
+    """
+    if output_format is None:
+        output_format = 'sqlite' if Path(path).suffix.lower() in ('.sqlite', '.sqlite3', '.db') else 'jsonl'
+    if output_format == 'sqlite':
+        return _SqliteOutput(path)
+    return _JsonlOutput(path)
+
+
+def scan_library(root, output_path, manifest_path=None, output_format=None, workers=None,
+                 retry_errors=False, **options):
+    """
+    Scan een muziekmap en analyseer alle nieuwe of gewijzigde bestanden
+
+    Args:
+        root: Pad naar muziekmap
+        output_path: Pad naar JSONL of SQLite output
+        manifest_path: Pad naar manifest (default: <output_path>.manifest.json)
+        output_format: 'jsonl' of 'sqlite' (None = afleiden uit extensie)
+        workers: Aantal parallelle processen (default: aantal cores)
+        retry_errors: Bestanden die vorige keer faalden opnieuw proberen
+        **options: Doorgegeven aan analyze_audio_simple (sample_rate, include_waveform, ...)
+
+    Returns:
+        Dictionary met: total, skipped, analyzed, failed, interrupted
+    """
+    root = Path(root).expanduser().resolve()
+    manifest_path = manifest_path or f"{output_path}.manifest.json"
+    manifest = load_manifest(manifest_path)
+
+    todo, skipped = plan_scan(root, manifest, retry_errors=retry_errors)
+    save_manifest(manifest, manifest_path)
+
+    stats = {'total': len(todo) + skipped, 'skipped': skipped, 'analyzed': 0, 'failed': 0, 'interrupted': False}
+    print(f"{stats['total']} audio bestanden gevonden, {skipped} ongewijzigd, {len(todo)} te analyseren")
+    if not todo:
+        return stats
+
+    output = open_output(output_path, output_format)
+    last_save = time.time()
+
+    def handle(record):
+        nonlocal last_save
+        done = stats['analyzed'] + stats['failed'] + 1
+        prefix = f"[{done}/{len(todo)}] {record['path']}"
+        entry = {'size': record['size'], 'mtime': record['mtime'], 'hash': record.get('hash')}
+
+        if 'error' in record:
+            stats['failed'] += 1
+            entry.update(status='error', error=record['error'])
+            print(f"{prefix}: fout: {record['error']}")
+        else:
+            # Eerst het resultaat wegschrijven, daarna pas als klaar markeren in het manifest
+            analyzed_at = datetime.now(timezone.utc).isoformat()
+            output.write(record, analyzed_at)
+            stats['analyzed'] += 1
+            entry.update(status='done', analyzed_at=analyzed_at)
+            analysis = record['analysis']
+            print(f"{prefix}: {analysis.get('bpm')} BPM, {analysis.get('key')} ({record['elapsed']}s)")
+
+        manifest['files'][record['path']] = entry
+        if time.time() - last_save >= MANIFEST_SAVE_INTERVAL:
+            save_manifest(manifest, manifest_path)
+            last_save = time.time()
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            futures = [executor.submit(_analyze_file, str(root), rel_path, size, mtime, options)
+                       for rel_path, size, mtime in todo]
+            # Al verwerkte futures, zodat ze na een onderbreking niet nog eens geschreven worden
+            handled = set()
+            try:
+                for future in as_completed(futures):
+                    handled.add(future)
+                    handle(future.result())
+            except KeyboardInterrupt:
+                # Wachtrij annuleren, lopende analyses nog afmaken en bewaren
+                stats['interrupted'] = True
+                print("Onderbroken, lopende analyses worden afgerond (nogmaals Ctrl+C om direct te stoppen)...")
+                for future in futures:
+                    future.cancel()
+                for future in futures:
+                    if not future.cancelled() and future not in handled:
+                        handled.add(future)
+                        handle(future.result())
+    finally:
+        output.close()
+        save_manifest(manifest, manifest_path)
+
+    return stats
+
+
+def main(argv=None):
+    """
+    Command line entry point (python -m python scan <dir>)
+    """
+    parser = argparse.ArgumentParser(prog='python -m python', description='Opperbeat music analyzer')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    scan = subparsers.add_parser('scan', help='Analyseer een muziekmap (incrementeel en hervatbaar)')
+    scan.add_argument('directory', help='Muziekmap om te scannen')
+    scan.add_argument('--output', '-o', default='opperbeat_analyses.jsonl',
+                      help='Output bestand, .jsonl of .sqlite/.db (default: opperbeat_analyses.jsonl)')
+    scan.add_argument('--format', choices=['jsonl', 'sqlite'], default=None,
+                      help='Output formaat (default: afgeleid uit extensie)')
+    scan.add_argument('--manifest', default=None, help='Manifest pad (default: <output>.manifest.json)')
+    scan.add_argument('--workers', '-j', type=int, default=None, help='Aantal parallelle processen (default: aantal cores)')
+    scan.add_argument('--sample-rate', type=int, default=44100, help='Sample rate voor analyse (default: 44100)')
+    scan.add_argument('--max-duration', type=float, default=None, help='Analyseer maximaal zoveel seconden per bestand')
+    scan.add_argument('--include-waveform', action='store_true', help='Waveform data opnemen in de resultaten')
+    scan.add_argument('--waveform-samples', type=int, default=5000, help='Aantal waveform samples (default: 5000)')
+    scan.add_argument('--retry-errors', action='store_true', help='Bestanden die eerder faalden opnieuw proberen')
+    scan.add_argument('--fingerprint-index', default=None,
+                      help='Fingerprint index (JSONL) om analyses te hergebruiken tussen encodings van dezelfde opname')
+
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"Map niet gevonden: {args.directory}")
+
+    start = time.time()
+    stats = scan_library(
+        args.directory,
+        args.output,
+        manifest_path=args.manifest,
+        output_format=args.format,
+        workers=args.workers,
+        retry_errors=args.retry_errors,
+        sample_rate=args.sample_rate,
+        include_waveform=args.include_waveform,
+        waveform_samples=args.waveform_samples,
+        max_duration=args.max_duration,
+        fingerprint_index=args.fingerprint_index,
+    )
+
+    print(f"Klaar in {time.time() - start:.1f}s: {stats['analyzed']} geanalyseerd, "
+          f"{stats['skipped']} overgeslagen, {stats['failed']} mislukt")
+    if stats['interrupted']:
+        print("Scan onderbroken; start hetzelfde commando opnieuw om te hervatten")
+        return 130
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Benchmark response encodings voor analyse resultaten
+Meet payload grootte en encode tijd per formaat, waveform dtype en compressie
+
+Gebruik (vanuit de repository root):
+    python scripts/bench_encoding.py
+    python scripts/bench_encoding.py --samples 2000 --repeat 200
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from python.encoding import (  # noqa: E402
+    COMPRESSIBLE_MEDIA_TYPES,
+    MEDIA_TYPE_JSON,
+    MEDIA_TYPE_MSGPACK,
+    ORJSON_AVAILABLE,
+    compress,
+    encode_body,
+    supported_media_types,
+    BROTLI_AVAILABLE,
+)
+
+
+def make_result(samples):
+    """Synthetisch resultaat met een muziekachtige waveform (zoals analyze_audio_simple)"""
+    rng = np.random.default_rng(42)
+    t = np.linspace(0, 180, samples)
+    envelope = 0.5 + 0.4 * np.sin(2 * np.pi * t / 32) ** 2
+    waveform = envelope * rng.uniform(-1, 1, samples) * 0.8
+    return {
+        "bpm": 124,
+        "bpm_confidence": 0.912,
+        "key": "A minor",
+        "key_confidence": 0.781,
+        "song_name": "Benchmark Track",
+        "duration": 180.0,
+        "duration_formatted": "3:00",
+        "bitrate": 320,
+        "waveform": {
+            "waveform": waveform,
+            "waveform_samples": samples,
+            "original_samples": 180 * 44100,
+            "sample_rate": 44100,
+            "downsampled": True,
+        },
+    }
+
+
+def time_call(func, repeat):
+    """Mediane duur van func() in milliseconden"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return float(np.median(durations))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark response encodings")
+    parser.add_argument("--samples", type=int, default=5000, help="Aantal waveform samples (default: 5000)")
+    parser.add_argument("--repeat", type=int, default=100, help="Aantal herhalingen per meting (default: 100)")
+    args = parser.parse_args()
+
+    result = make_result(args.samples)
+
+    # Referentie: oude situatie (waveform.tolist() + standaard json)
+    legacy = dict(result, waveform=dict(result["waveform"], waveform=result["waveform"]["waveform"].tolist()))
+    legacy_body = json.dumps(legacy).encode("utf-8")
+    legacy_ms = time_call(lambda: json.dumps(legacy).encode("utf-8"), args.repeat)
+
+    print(f"orjson: {ORJSON_AVAILABLE}, brotli: {BROTLI_AVAILABLE}, waveform samples: {args.samples}")
+    print(f"{'formaat':<44} {'dtype':<8} {'compressie':<10} {'bytes':>9} {'encode ms':>10}")
+    print(f"{'json (legacy tolist + json.dumps)':<44} {'float64':<8} {'-':<10} {len(legacy_body):>9} {legacy_ms:>10.3f}")
+
+    encodings = [None, "gzip"] + (["br"] if BROTLI_AVAILABLE else [])
+    for media_type in supported_media_types():
+        dtypes = [None, "int16", "int8"] if media_type == MEDIA_TYPE_JSON else ["float32", "int16", "int8"]
+        for dtype in dtypes:
+            body = encode_body(result, media_type, dtype)
+            # encode_result comprimeert alleen COMPRESSIBLE_MEDIA_TYPES
+            for encoding in (encodings if media_type in COMPRESSIBLE_MEDIA_TYPES else [None]):
+                encoded = compress(body, encoding)
+                encode_ms = time_call(lambda: compress(encode_body(result, media_type, dtype), encoding), args.repeat)
+                print(f"{media_type:<44} {dtype or 'float32':<8} {encoding or '-':<10} {len(encoded):>9} {encode_ms:>10.3f}")
+
+    if MEDIA_TYPE_MSGPACK not in supported_media_types():
+        print("msgpack niet geïnstalleerd, MessagePack overgeslagen")
+
+
+if __name__ == "__main__":
+    main()
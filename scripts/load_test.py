@@ -0,0 +1,479 @@
+"""
+Load test voor de analyse API
+Start api.analyze:app lokaal (uvicorn of gunicorn), stuurt een mix van synthetische uploads
+(lengte, formaat, waveform aan/uit) met een vaste concurrency of een Poisson aankomstratio,
+en rapporteert doorvoer, p50/p95/p99 latency, foutpercentages en het RSS geheugen van de server
+
+Gebruik (vanuit de repository root):
+    python scripts/load_test.py --concurrency 4 --duration 60
+    python scripts/load_test.py --rate 0.5 --duration 120 --server gunicorn --workers 2
+    python scripts/load_test.py --lengths 10,30,180 --formats wav,flac --waveform-ratio 0.5
+    python scripts/load_test.py --url http://127.0.0.1:8000 --concurrency 8 --json result.json
+"""
+
+import argparse
+import http.client
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+import wave
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+try:
+    import soundfile as sf
+    SOUNDFILE_AVAILABLE = True
+except ImportError:
+    SOUNDFILE_AVAILABLE = False
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Railway breekt requests na ~30 seconden af; dat is de grens voor "te traag"
+DEFAULT_SLA = 30.0
+# De client wacht ruim langer, zodat ook trage antwoorden gemeten worden
+DEFAULT_TIMEOUT = 120.0
+UPLOAD_SAMPLE_RATE = 44100
+
+
+def make_audio(seconds, sr=UPLOAD_SAMPLE_RATE, seed=0):
+    """Synthetische stereo track: kick op elke tel, een akkoord en wat ruis (int16)"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    bpm = float(rng.uniform(90, 140))
+    root = 220.0 * 2 ** (int(rng.integers(12)) / 12)
+    y = sum(0.15 * np.sin(2 * np.pi * root * 2 ** (i / 12) * t) for i in (0, 4, 7))
+    phase = t % (60.0 / bpm)
+    y = y + 0.8 * np.exp(-phase * 40) * np.sin(2 * np.pi * 60 * phase)
+    y = y + 0.02 * rng.standard_normal(len(t))
+    y = y / np.max(np.abs(y)) * 0.9
+    return (np.stack([y, y], axis=1) * 32767).astype(np.int16)
+
+
+def encode_audio(audio, fmt, sr=UPLOAD_SAMPLE_RATE):
+    """Encodeer int16 stereo audio als wav (stdlib) of flac (soundfile)"""
+    buffer = io.BytesIO()
+    if fmt == "wav":
+        with wave.open(buffer, "wb") as wav_file:
+            wav_file.setnchannels(audio.shape[1])
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(sr)
+            wav_file.writeframes(audio.tobytes())
+    elif fmt == "flac":
+        sf.write(buffer, audio, sr, format="FLAC", subtype="PCM_16")
+    else:
+        raise ValueError(f"Onbekend formaat: {fmt}")
+    return buffer.getvalue()
+
+
+def build_payloads(lengths, formats):
+    """Eén upload per (lengte, formaat) combinatie; wordt voor elke request hergebruikt"""
+    payloads = {}
+    for index, seconds in enumerate(lengths):
+        audio = make_audio(seconds, seed=index)
+        for fmt in formats:
+            payloads[(seconds, fmt)] = encode_audio(audio, fmt)
+    return payloads
+
+
+def multipart_body(filename, data, fields):
+    """Bouw een multipart/form-data body (zonder externe dependencies)"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'.encode()
+    )
+    parts.append(data)
+    parts.append(f'\r\n--{boundary}--\r\n'.encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class Client:
+    """
+    Eén keep-alive verbinding per thread
+
+    Faalt een hergebruikte verbinding voordat er iets van het antwoord binnen is (de server
+    heeft hem net gesloten, bijv. keep-alive timeout of een recyclende worker), dan wordt
+    de request één keer opnieuw gestuurd over een nieuwe verbinding, zoals browsers doen.
+    """
+
+    def __init__(self, url, timeout):
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _connection(self):
+        """Geeft (verbinding, hergebruikt)"""
+        if getattr(self.local, "connection", None) is None:
+            self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            return self.local.connection, False
+        return self.local.connection, True
+
+    def post(self, path, body, content_type):
+        """Stuur een request; geeft (status, response bytes) of (foutnaam, None)"""
+        connection, reused = self._connection()
+        try:
+            try:
+                connection.request("POST", path, body=body, headers={"Content-Type": content_type})
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                if not reused:
+                    raise
+                self.close()
+                connection, _ = self._connection()
+                connection.request("POST", path, body=body, headers={"Content-Type": content_type})
+                response = connection.getresponse()
+            data = response.read()
+            if response.getheader("connection", "").lower() == "close":
+                self.close()
+            return response.status, data
+        except socket.timeout:
+            self.close()
+            return "timeout", None
+        except (ConnectionError, http.client.HTTPException, OSError) as e:
+            self.close()
+            return type(e).__name__, None
+
+    def close(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+
+def process_tree(pid):
+    """Alle pids in de procesboom onder pid (inclusief pid), via /proc"""
+    children = defaultdict(list)
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat_file:
+                # Veld 4 is de parent pid; de procesnaam (veld 2) kan spaties bevatten
+                parent = int(stat_file.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children[parent].append(int(entry))
+
+    pids, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        pids.append(current)
+        stack.extend(children.get(current, []))
+    return pids
+
+
+def rss_mb(pid):
+    """Resident set size van een proces in MB (0 als het proces niet meer bestaat)"""
+    try:
+        with open(f"/proc/{pid}/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class RssSampler(threading.Thread):
+    """Meet periodiek het totale RSS van de server procesboom (master + workers)"""
+
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.peak_per_process = 0.0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            values = [rss_mb(pid) for pid in process_tree(self.pid)]
+            self.samples.append(sum(values))
+            self.peak_per_process = max([self.peak_per_process] + values)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, workers, log_file):
+    """Start de API lokaal op een vrije poort en wacht tot /health antwoordt"""
+    port = free_port()
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers))
+    if kind == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+                   "-b", f"127.0.0.1:{port}", "api.analyze:app"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "api.analyze:app",
+                   "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server gestopt tijdens opstarten (exit code {process.returncode})")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/health")
+            if connection.getresponse().status == 200:
+                return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError("Server niet bereikbaar binnen 120 seconden")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+class LoadTest:
+    def __init__(self, args, payloads, client):
+        self.args = args
+        self.payloads = payloads
+        self.client = client
+        self.keys = sorted(payloads)
+        self.random = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.records = []
+
+    def next_request(self):
+        """Kies willekeurig een upload en of de waveform meegestuurd wordt"""
+        with self.lock:
+            seconds, fmt = self.random.choice(self.keys)
+            include_waveform = self.random.random() < self.args.waveform_ratio
+        fields = {"include_waveform": "true" if include_waveform else "false"}
+        body, content_type = multipart_body(f"load_{seconds}s.{fmt}", self.payloads[(seconds, fmt)], fields)
+        return (seconds, fmt, include_waveform), body, content_type
+
+    def send(self, scheduled=None):
+        scenario, body, content_type = self.next_request()
+        start = time.perf_counter()
+        status, _ = self.client.post("/api/analyze", body, content_type)
+        end = time.perf_counter()
+        # Open loop: latency vanaf het geplande vertrek, zodat wachttijd in de client meetelt
+        latency = end - (scheduled if scheduled is not None else start)
+        with self.lock:
+            self.records.append({"scenario": scenario, "status": status, "latency": latency, "end": end})
+
+    def run_closed_loop(self, deadline):
+        """Vaste concurrency: elke thread stuurt direct een nieuwe request na een antwoord"""
+        def worker():
+            while time.perf_counter() < deadline:
+                self.send()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_open_loop(self, deadline):
+        """Poisson aankomsten met gemiddeld --rate requests per seconde, onafhankelijk van antwoorden"""
+        rng = random.Random(self.args.seed + 1)
+        with ThreadPoolExecutor(max_workers=self.args.max_in_flight) as executor:
+            scheduled = time.perf_counter()
+            while True:
+                scheduled += rng.expovariate(self.args.rate)
+                if scheduled >= deadline:
+                    break
+                time.sleep(max(0.0, scheduled - time.perf_counter()))
+                executor.submit(self.send, scheduled)
+
+
+def percentiles(latencies):
+    if not latencies:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    values = np.percentile(latencies, [50, 95, 99, 100])
+    return {name: round(float(v), 3) for name, v in zip(("p50", "p95", "p99", "max"), values)}
+
+
+def summarize(records, wall_time, sampler, sla):
+    ok = [r for r in records if r["status"] == 200]
+    statuses = Counter(str(r["status"]) for r in records)
+    summary = {
+        "requests": len(records),
+        "ok": len(ok),
+        "wall_time": round(wall_time, 2),
+        "throughput": round(len(ok) / wall_time, 3) if wall_time else 0.0,
+        "latency": percentiles([r["latency"] for r in ok]),
+        # Trage antwoorden en client timeouts: beide waren door Railway afgebroken
+        "over_sla": sum(1 for r in records if r["status"] == "timeout" or (r["status"] == 200 and r["latency"] > sla)),
+        "client_timeouts": sum(1 for r in records if r["status"] == "timeout"),
+        "status_counts": dict(statuses),
+        "error_rate": round(1 - len(ok) / len(records), 4) if records else 0.0,
+        "scenarios": {},
+    }
+
+    by_scenario = defaultdict(list)
+    for record in records:
+        by_scenario[record["scenario"]].append(record)
+    for (seconds, fmt, include_waveform), group in sorted(by_scenario.items()):
+        group_ok = [r["latency"] for r in group if r["status"] == 200]
+        name = f"{seconds}s {fmt} waveform={'aan' if include_waveform else 'uit'}"
+        summary["scenarios"][name] = {
+            "requests": len(group),
+            "ok": len(group_ok),
+            "latency": percentiles(group_ok),
+        }
+
+    if sampler is not None and sampler.samples:
+        summary["rss_mb"] = {
+            "peak_total": round(max(sampler.samples), 1),
+            "mean_total": round(float(np.mean(sampler.samples)), 1),
+            "final_total": round(sampler.samples[-1], 1),
+            "peak_process": round(sampler.peak_per_process, 1),
+        }
+    return summary
+
+
+def print_summary(summary, sla):
+    latency = summary["latency"]
+    print(f"\nrequests: {summary['requests']}  ok: {summary['ok']}  "
+          f"foutpercentage: {summary['error_rate']:.1%}  doorvoer: {summary['throughput']:.2f} req/s")
+    if latency["p50"] is not None:
+        print(f"latency (s): p50 {latency['p50']:.2f}  p95 {latency['p95']:.2f}  "
+              f"p99 {latency['p99']:.2f}  max {latency['max']:.2f}")
+    print(f"status: {', '.join(f'{k}: {v}' for k, v in sorted(summary['status_counts'].items()))}")
+    print(f"langer dan {sla:.0f} s (Railway timeout): {summary['over_sla']}  "
+          f"(waarvan client timeouts: {summary['client_timeouts']})")
+    if "rss_mb" in summary:
+        rss = summary["rss_mb"]
+        print(f"server RSS (MB): piek {rss['peak_total']:.0f}  gemiddeld {rss['mean_total']:.0f}  "
+              f"eind {rss['final_total']:.0f}  piek per proces {rss['peak_process']:.0f}")
+
+    print(f"\n{'scenario':<32} {'requests':>8} {'ok':>6} {'p50':>7} {'p95':>7} {'p99':>7}")
+    for name, scenario in summary["scenarios"].items():
+        values = scenario["latency"]
+        cells = [f"{values[p]:>7.2f}" if values[p] is not None else f"{'-':>7}" for p in ("p50", "p95", "p99")]
+        print(f"{name:<32} {scenario['requests']:>8} {scenario['ok']:>6} {' '.join(cells)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test voor de analyse API")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--concurrency", type=int, default=None,
+                      help="Closed loop: aantal gelijktijdige clients (default: 2)")
+    load.add_argument("--rate", type=float, default=None,
+                      help="Open loop: gemiddeld aantal requests per seconde (Poisson aankomsten)")
+    parser.add_argument("--duration", type=float, default=60, help="Duur van de meting in seconden (default: 60)")
+    parser.add_argument("--lengths", default="10,30,180",
+                        help="Lengtes van de synthetische uploads in seconden (default: 10,30,180)")
+    parser.add_argument("--formats", default="wav,flac" if SOUNDFILE_AVAILABLE else "wav",
+                        help="Upload formaten: wav en/of flac (default: wav,flac)")
+    parser.add_argument("--waveform-ratio", type=float, default=0.5,
+                        help="Fractie van de requests met include_waveform=true (default: 0.5)")
+    parser.add_argument("--server", choices=["uvicorn", "gunicorn"], default="uvicorn",
+                        help="Hoe de API lokaal gestart wordt (default: uvicorn)")
+    parser.add_argument("--workers", type=int, default=1, help="Aantal server workers (default: 1)")
+    parser.add_argument("--url", default=None, help="Gebruik een al draaiende server in plaats van er een te starten")
+    parser.add_argument("--sla", type=float, default=DEFAULT_SLA,
+                        help="Maximale latency in seconden, zoals de Railway timeout (default: 30)")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help="Client timeout per request in seconden, ruim boven --sla (default: 120)")
+    parser.add_argument("--max-in-flight", type=int, default=64,
+                        help="Open loop: maximaal aantal openstaande requests (default: 64)")
+    parser.add_argument("--warmup", type=int, default=1, help="Aantal requests voor de meting (default: 1)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--server-log", default=os.devnull, help="Schrijf server output naar dit bestand")
+    parser.add_argument("--json", default=None, help="Schrijf het resultaat ook als JSON naar dit bestand")
+    args = parser.parse_args()
+    if args.timeout <= args.sla:
+        parser.error("--timeout moet groter zijn dan --sla, anders zijn trage antwoorden niet te meten")
+    if args.concurrency is None and args.rate is None:
+        args.concurrency = 2
+
+    formats = [fmt.strip() for fmt in args.formats.split(",") if fmt.strip()]
+    if "flac" in formats and not SOUNDFILE_AVAILABLE:
+        parser.error("flac uploads vereisen soundfile")
+    lengths = [float(value) if "." in value else int(value) for value in args.lengths.split(",")]
+
+    print(f"Genereren van uploads: lengtes {lengths} s, formaten {formats}")
+    payloads = build_payloads(lengths, formats)
+    for (seconds, fmt), data in sorted(payloads.items()):
+        print(f"  {seconds}s {fmt}: {len(data) / (1024 * 1024):.1f} MB")
+
+    server, sampler = None, None
+    log_file = open(args.server_log, "wb")
+    try:
+        if args.url:
+            url = args.url
+        else:
+            print(f"Starten van {args.server} met {args.workers} worker(s)...")
+            server, url = start_server(args.server, args.workers, log_file)
+            sampler = RssSampler(server.pid)
+
+        test = LoadTest(args, payloads, Client(url, args.timeout))
+        for _ in range(args.warmup):
+            test.send()
+        test.records.clear()
+
+        mode = f"concurrency {args.concurrency}" if args.rate is None else f"rate {args.rate}/s"
+        print(f"Meting: {mode}, {args.duration:.0f} s tegen {url}")
+        if sampler is not None:
+            sampler.start()
+        start = time.perf_counter()
+        deadline = start + args.duration
+        if args.rate is None:
+            test.run_closed_loop(deadline)
+        else:
+            test.run_open_loop(deadline)
+        wall_time = time.perf_counter() - start
+        if sampler is not None:
+            sampler.stop()
+    finally:
+        if server is not None:
+            stop_server(server)
+        log_file.close()
+
+    summary = summarize(test.records, wall_time, sampler, args.sla)
+    summary["config"] = {
+        "mode": "closed" if args.rate is None else "open",
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "duration": args.duration,
+        "lengths": lengths,
+        "formats": formats,
+        "waveform_ratio": args.waveform_ratio,
+        "server": None if args.url else args.server,
+        "workers": None if args.url else args.workers,
+        "sla": args.sla,
+        "timeout": args.timeout,
+    }
+    print_summary(summary, args.sla)
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(summary, json_file, indent=2)
+        print(f"\nResultaat geschreven naar {args.json}")
+
+
+if __name__ == "__main__":
+    main()